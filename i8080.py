@@ -5,14 +5,23 @@
 # (C) Stanislav Yudin (CityAceE)
 # http://zx-pk.ru
 
-import spyc_keyboard
-
 memory = memoryview(bytearray(65536))
 
+# Memory map of 256 pages, 256 bytes each. Plain RAM and ROM pages are None
+# in read_map and write_map and go straight to memory, other pages call
+# read(addr) and write(addr, byte) functions of devices set by map_pages()
+read_map = [None] * 256
+write_map = [None] * 256  # Writers in use, translated code pages included
+page_write = [None] * 256  # Writers as mapped
+read_top = 0x10000  # Lowest address of a page with reader, plain memory below it
+
 ticks = 0  # Ticks number since interrupt
 pc = 0  # Program counter
 sp = 0  # Stack pointer
 
+code_written = None  # Called with address when translated code is overwritten
+code_dirty = False  # Set when running block may have been overwritten
+
 regfile = bytearray(8)
 regfile_mv = memoryview(regfile)
 reg_b = regfile_mv[1:2]
@@ -54,26 +63,57 @@ sub_h_table = (False, True, True, True, False, False, False, True)
 
 def write_mem(addr, byte):
     # Write one byte to memory address
-    # ROM write blocking and memory mapping here
-
-    # Specialist ROM block writing
-    if addr < 0xc000:
+    device = write_map[addr >> 8]
+    if device is None:
         memory[addr] = byte
-
-    # Specialist keyboard ports writing
-    if 0xf7ff < addr <= 0xffff:
-        spyc_keyboard.write_kb_ports(addr, byte)
+    else:
+        device(addr, byte)
 
 
 def read_mem(addr):
     # Read one byte from memory address
-    # Configure memory mapping here
-
-    # Specialist keyboard ports reading
-    if addr < 0xf800:
+    if addr < read_top:
+        return memory[addr]
+    device = read_map[addr >> 8]
+    if device is None:
         return memory[addr]
+    return device(addr)
+
+
+def rom_write(addr, byte):
+    # Writing to ROM does nothing
+    return
+
+
+def code_write(addr, byte):
+    # Writer of pages holding translated code
+    device = page_write[addr >> 8]
+    if device is None:
+        memory[addr] = byte
     else:
-        return spyc_keyboard.read_kb_ports(addr)
+        device(addr, byte)
+    code_written(addr)
+
+
+def map_pages(first, last, read=None, write=None):
+    # Connect device to pages from first to last, None is plain memory
+    global read_top
+    for page in range(first, last + 1):
+        read_map[page] = read
+        page_write[page] = write
+        if write_map[page] is not code_write:
+            write_map[page] = write
+    read_top = next((page << 8 for page in range(256) if read_map[page] is not None), 0x10000)
+
+
+def watch_code(page, on):
+    # Catch writes to page with translated code (on) or stop doing it
+    if page_write[page] is not rom_write:
+        write_map[page] = code_write if on else page_write[page]
+
+
+# Specialist ROM block writing
+map_pages(0xc0, 0xff, None, rom_write)
 
 
 def write_port(port, byte):
@@ -285,6 +325,233 @@ def dec_reg(reg):
     return reg
 
 
+def daa():
+    global flag_c
+    carry = flag_c
+    addition = 0
+    if flag_h or ((reg_a[0] % 0x10) > 0x09):
+        addition = 0x06
+    if flag_c or (reg_a[0] > 0x9f) or ((reg_a[0] > 0x8f) and ((reg_a[0] % 0x10) > 0x09)):
+        addition |= 0x60
+    if reg_a[0] > 0x99:
+        carry = True
+    add_a(addition)
+    flag_c = carry
+
+
+# Lazy flags evaluation
+# ALU helpers below store only the last result (for S, Z and P flags) and a
+# value with half-carry in bit 4. Flags are computed from them only when a
+# conditional instruction, PUSH PSW or DAA needs them.
+
+lazy_flags = False
+flag_res = 0  # Last 8 bit result or 0x100 | S << 2 | Z << 1 | P after POP PSW
+flag_aux = 0  # Half-carry flag in bit 4
+
+s_table = tuple(bool(i & 0x80) for i in range(256)) + tuple(bool(i & 4) for i in range(8))
+z_table = (True,) + (False,) * 255 + tuple(bool(i & 2) for i in range(8))
+lazy_p_table = tuple(p_table) + tuple(bool(i & 1) for i in range(8))
+
+
+def lazy_flags2f():
+    # Compute flags from the last result and pack them into F register
+    global flag_p, flag_h, flag_z, flag_s
+    flag_s = s_table[flag_res]
+    flag_z = z_table[flag_res]
+    flag_p = lazy_p_table[flag_res]
+    flag_h = bool(flag_aux & 0x10)
+    eager_helpers['flags2f']()
+
+
+def lazy_f2flags():
+    # F register to carry flag and lazy flags state
+    global flag_res, flag_aux
+    eager_helpers['f2flags']()
+    flag_res = 0x100 | flag_s << 2 | flag_z << 1 | flag_p
+    flag_aux = flag_h << 4
+
+
+def lazy_get_conditions(n):
+    return [z_table[flag_res], flag_c, lazy_p_table[flag_res], s_table[flag_res]][n]
+
+
+def lazy_and_a(reg):
+    global flag_res, flag_aux, flag_c
+    flag_aux = (reg_a[0] | reg) << 1
+    reg_a[0] = flag_res = reg_a[0] & reg
+    flag_c = False
+
+
+def lazy_xor_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_a[0] = flag_res = reg_a[0] ^ reg
+    flag_aux = 0
+    flag_c = False
+
+
+def lazy_or_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_a[0] = flag_res = reg_a[0] | reg
+    flag_aux = 0
+    flag_c = False
+
+
+def lazy_cp_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_temp = reg_a[0] - reg
+    flag_res = reg_temp & 0xff
+    flag_aux = ~(reg_a[0] ^ reg ^ reg_temp)
+    flag_c = reg_temp < 0
+
+
+def lazy_add_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_temp = reg_a[0] + reg
+    flag_aux = reg_a[0] ^ reg ^ reg_temp
+    reg_a[0] = flag_res = reg_temp & 0xff
+    flag_c = reg_temp > 0xff
+
+
+def lazy_adc_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_temp = reg_a[0] + reg + flag_c
+    flag_aux = reg_a[0] ^ reg ^ reg_temp
+    reg_a[0] = flag_res = reg_temp & 0xff
+    flag_c = reg_temp > 0xff
+
+
+def lazy_sub_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_temp = reg_a[0] - reg
+    flag_aux = ~(reg_a[0] ^ reg ^ reg_temp)
+    reg_a[0] = flag_res = reg_temp & 0xff
+    flag_c = reg_temp < 0
+
+
+def lazy_sbc_a(reg):
+    global flag_res, flag_aux, flag_c
+    reg_temp = reg_a[0] - reg - flag_c
+    flag_aux = ~(reg_a[0] ^ reg ^ reg_temp)
+    reg_a[0] = flag_res = reg_temp & 0xff
+    flag_c = reg_temp < 0
+
+
+def lazy_inc_reg(reg):
+    global flag_res, flag_aux
+    flag_aux = reg ^ (reg + 1)
+    flag_res = (reg + 1) & 0xff
+    return flag_res
+
+
+def lazy_dec_reg(reg):
+    global flag_res, flag_aux
+    flag_aux = ~(reg ^ (reg - 1))
+    flag_res = (reg - 1) & 0xff
+    return flag_res
+
+
+def lazy_daa():
+    global flag_c
+    carry = flag_c
+    addition = 0
+    if flag_aux & 0x10 or ((reg_a[0] % 0x10) > 0x09):
+        addition = 0x06
+    if flag_c or (reg_a[0] > 0x9f) or ((reg_a[0] > 0x8f) and ((reg_a[0] % 0x10) > 0x09)):
+        addition |= 0x60
+    if reg_a[0] > 0x99:
+        carry = True
+    add_a(addition)
+    flag_c = carry
+
+
+# ALU tables for lazy flags mode, built by i8080_alu. Entries are F << 8 | result
+add_table = None  # carry << 16 | A << 8 | operand
+sub_table = None  # carry << 16 | A << 8 | operand
+inr_table = None  # operand
+dcr_table = None  # operand
+daa_table = None  # half-carry << 9 | carry << 8 | A
+
+
+def table_cp_a(reg):
+    global flag_res, flag_aux, flag_c
+    entry = sub_table[reg_a[0] << 8 | reg]
+    flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+def table_add_a(reg):
+    global flag_res, flag_aux, flag_c
+    entry = add_table[reg_a[0] << 8 | reg]
+    reg_a[0] = flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+def table_adc_a(reg):
+    global flag_res, flag_aux, flag_c
+    entry = add_table[flag_c << 16 | reg_a[0] << 8 | reg]
+    reg_a[0] = flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+def table_sub_a(reg):
+    global flag_res, flag_aux, flag_c
+    entry = sub_table[reg_a[0] << 8 | reg]
+    reg_a[0] = flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+def table_sbc_a(reg):
+    global flag_res, flag_aux, flag_c
+    entry = sub_table[flag_c << 16 | reg_a[0] << 8 | reg]
+    reg_a[0] = flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+def table_inc_reg(reg):
+    global flag_res, flag_aux
+    entry = inr_table[reg]
+    flag_aux = entry >> 8
+    flag_res = entry & 0xff
+    return flag_res
+
+
+def table_dec_reg(reg):
+    global flag_res, flag_aux
+    entry = dcr_table[reg]
+    flag_aux = entry >> 8
+    flag_res = entry & 0xff
+    return flag_res
+
+
+def table_daa():
+    global flag_res, flag_aux, flag_c
+    entry = daa_table[(flag_aux & 0x10) << 5 | flag_c << 8 | reg_a[0]]
+    reg_a[0] = flag_res = entry & 0xff
+    flag_aux = f = entry >> 8
+    flag_c = f & 1
+
+
+helper_names = ('flags2f', 'f2flags', 'get_conditions', 'and_a', 'xor_a', 'or_a', 'cp_a',
+                'add_a', 'adc_a', 'sub_a', 'sbc_a', 'inc_reg', 'dec_reg', 'daa')
+eager_helpers = {name: globals()[name] for name in helper_names}
+lazy_helpers = {name: globals()['lazy_' + name] for name in helper_names}
+
+
+def set_lazy_flags(on):
+    # Switch ALU helpers between eager and lazy flags evaluation
+    global lazy_flags
+    if on != lazy_flags:
+        flags2f()
+        globals().update(lazy_helpers if on else eager_helpers)
+        f2flags()
+        lazy_flags = on
+
+
 # CPU instructions set emulation
 
 # 00 XXX XXX opcodes group
@@ -527,17 +794,8 @@ def b00011111():  # RRA / RAR
 
 
 def b00100111():  # DAA / DAA
-    global pc, ticks, flag_c
-    carry = flag_c
-    addition = 0
-    if flag_h or ((reg_a[0] % 0x10) > 0x09):
-        addition = 0x06
-    if flag_c or (reg_a[0] > 0x9f) or ((reg_a[0] > 0x8f) and ((reg_a[0] % 0x10) > 0x09)):
-        addition |= 0x60
-    if reg_a[0] > 0x99:
-        carry = True
-    add_a(addition)
-    flag_c = carry
+    global pc, ticks
+    daa()
     pc = inc_pc()
     ticks += 4
     return
@@ -1049,11 +1307,26 @@ opcodes = {0x00: b00000000, 0x08: b00000000, 0x10: b00000000, 0x18: b00000000,
            0xC7: b11000111, 0xCF: b11000111, 0xD7: b11000111, 0xDF: b11000111,
            0xE7: b11000111, 0xEF: b11000111, 0xF7: b11000111, 0xFF: b11000111}
 
+dispatch = [opcodes[i] for i in range(256)]  # Opcodes table as a list for core() and run()
+
 
 def core():
     global opcode
     opcode = memory[pc]
-    return opcodes[opcode]()
+    return dispatch[opcode]()
+
+
+def run(budget):
+    # Execute instructions until budget ticks are used, return ticks used
+    global opcode
+    start = ticks
+    end = start + budget
+    mem = memory
+    table = dispatch
+    while ticks < end:
+        opcode = mem[pc]
+        table[opcode]()
+    return ticks - start
 
 
 def fill_memory(codes):
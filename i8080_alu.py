@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Precomputed ALU tables (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# ADD/ADC, SUB/SBB/CMP, INR, DCR and DAA take result and packed F register
+# from a table indexed by operands, each entry is F << 8 | result. Tables are
+# used in lazy flags mode: F goes to flag_aux (half-carry is bit 4 of F as
+# well) and carry to flag_c, S, Z and P come from the result as usual.
+#
+# Budget, measured with Python 3.11 on x86-64 (python i8080_alu.py):
+#   memory   add and sub 256 KiB each, inr and dcr 512 B each, daa 2 KiB
+#   startup  about 60 ms to build all tables
+#   speed    DAA helper about 50% faster than lazy arithmetic, but ADD, ADC,
+#            SUB, SBB, CMP, INR and DCR 15-20% slower: an array lookup plus
+#            unpacking costs more than two integer operations in CPython.
+#            So tables are off by default (ALU_TABLES in spycialist.py).
+
+from array import array
+import timeit
+
+import i8080 as cpu
+
+table_names = ('cp_a', 'add_a', 'adc_a', 'sub_a', 'sbc_a', 'inc_reg', 'dec_reg', 'daa')
+
+# S, Z, P and always set bit 1 of F register for 8 bit result
+szp = [(r & 0x80) | (not r) << 6 | cpu.p_table[r] << 2 | 0x02 for r in range(256)]
+
+
+def add_entry(a, b, c):
+    r = a + b + c
+    return (szp[r & 0xff] | (a ^ b ^ r) & 0x10) << 8 | r
+
+
+def sub_entry(a, b, c):
+    r = (a - b - c) & 0x1ff
+    return (szp[r & 0xff] | ~(a ^ b ^ r) & 0x10) << 8 | r
+
+
+def daa_entry(a, c, h):
+    addition = 0
+    if h or ((a % 0x10) > 0x09):
+        addition = 0x06
+    if c or (a > 0x9f) or ((a > 0x8f) and ((a % 0x10) > 0x09)):
+        addition |= 0x60
+    entry = add_entry(a, addition, 0) & 0xfeff
+    if c or a > 0x99:
+        entry |= 0x100
+    return entry
+
+
+def build():
+    # Fill table slots of CPU module
+    cpu.add_table = array('H', [add_entry(a, b, c) for c in (0, 1) for a in range(256) for b in range(256)])
+    cpu.sub_table = array('H', [sub_entry(a, b, c) for c in (0, 1) for a in range(256) for b in range(256)])
+    cpu.inr_table = array('H', [add_entry(b, 1, 0) & 0xfeff for b in range(256)])
+    cpu.dcr_table = array('H', [sub_entry(b, 1, 0) & 0xfeff for b in range(256)])
+    cpu.daa_table = array('H', [daa_entry(a, c, h) for h in (0, 1) for c in (0, 1) for a in range(256)])
+
+
+def set_alu_tables(on):
+    # Use tables (on) or arithmetic for lazy flags mode helpers
+    if on and cpu.add_table is None:
+        build()
+    for name in table_names:
+        cpu.lazy_helpers[name] = getattr(cpu, ('table_' if on else 'lazy_') + name)
+    if cpu.lazy_flags:
+        cpu.__dict__.update(cpu.lazy_helpers)
+
+
+def verify():
+    # Compare table helpers with lazy arithmetic on all inputs, return
+    # names of helpers with different results
+    failed = set()
+    lazy = cpu.lazy_flags
+    cpu.set_lazy_flags(True)
+    for name in table_names:
+        for a in range(256):
+            for b in range(256 if name.endswith('_a') else 1):
+                for c in (False, True):
+                    for h in ((0, 0x10) if name == 'daa' else (0,)):
+                        results = []
+                        for prefix in ('lazy_', 'table_'):
+                            cpu.reg_a[0], cpu.flag_c, cpu.flag_aux = a, c, h
+                            value = getattr(cpu, prefix + name)(*(() if name == 'daa' else (b,)))
+                            cpu.flags2f()
+                            results.append((value, cpu.reg_a[0], cpu.reg_f[0], bool(cpu.flag_c)))
+                        if results[0] != results[1]:
+                            failed.add(name)
+    cpu.set_lazy_flags(lazy)
+    return sorted(failed)
+
+
+if __name__ == '__main__':
+    print('Build: %.0f ms' % (min(timeit.repeat(build, number=1, repeat=3)) * 1000))
+    print('Memory: %d bytes' % sum(len(t) * t.itemsize for t in (cpu.add_table, cpu.sub_table, cpu.inr_table,
+                                                                 cpu.dcr_table, cpu.daa_table)))
+    errors = verify()
+    print('Tables:', 'match lazy arithmetic' if not errors else 'mismatch ' + ' '.join(errors))
+    cpu.set_lazy_flags(True)
+    for name in table_names:
+        args = '' if name == 'daa' else '0x35'
+        times = [min(timeit.repeat('reg_a[0] = 0x47; %s%s(%s)' % (prefix, name, args), globals=cpu.__dict__,
+                                   number=200000, repeat=5)) for prefix in ('lazy_', 'table_')]
+        print('%-8s lazy %.3f s, table %.3f s, %+.0f%%' % (name, times[0], times[1], (times[0] / times[1] - 1) * 100))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Basic block translator (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Straight-line code up to the next jump, call or return is compiled into one
+# Python function. Functions are cached by start address and dropped as soon
+# as write_mem() touches their bytes, so self-modifying code keeps working.
+
+import i8080 as cpu
+import i8080_gen
+
+MAX_BLOCK = 32  # Instructions per block limit
+CODE_TOP = 0xf800 - 3  # Never translate code fetched from I/O area
+
+blocks = {}  # Start address -> block function
+block_end = {}  # Start address -> address after the last byte of block
+page_blocks = [set() for _ in range(256)]  # Page -> start addresses of blocks
+traps = {}  # Address -> native routine run instead of the block there, see spyc_hle
+loops = None  # Called with start, function and end of a new block, returns them for the cache, see i8080_loops
+deadline = 0  # Ticks run() goes up to, loops skipped by i8080_loops never pass it
+
+# Instructions which end a block: jumps, calls, returns, restarts and HLT
+ends_block = bytearray(256)
+for op in (0xc3, 0xcb, 0xcd, 0xdd, 0xed, 0xfd, 0xc9, 0xd9, 0xe9, 0x76):
+    ends_block[op] = 1
+for op in range(0xc0, 0x100, 8):
+    ends_block[op] = ends_block[op + 2] = ends_block[op + 4] = ends_block[op + 7] = 1
+
+# Instructions which may write memory and therefore modify the running block
+writes_mem = bytearray(256)
+for op in (0x02, 0x12, 0x22, 0x32, 0x34, 0x35, 0x36, 0x70, 0x71, 0x72, 0x73, 0x74, 0x75, 0x77,
+           0xe3, 0xc5, 0xd5, 0xe5, 0xf5):
+    writes_mem[op] = 1
+
+
+def translate(start):
+    # Compile block beginning at start address and put it into the cache
+    lines = []
+    addr = start
+    inline_ticks = 0  # Ticks of instructions not adding their own ones
+    count = 0
+    while True:
+        op = cpu.memory[addr]
+        code, ticks = i8080_gen.body(op, addr)
+        lines += code
+        if ticks is not None:
+            inline_ticks += ticks
+        count += 1
+        end = addr + i8080_gen.length[op]
+        if op != 0x76:  # HLT stays on its own address
+            addr = end
+        if ends_block[op] or count >= MAX_BLOCK or addr > CODE_TOP:
+            break
+        if writes_mem[op]:
+            lines.append('if code_dirty:')
+            lines.append('    pc = %d' % addr)
+            if inline_ticks:
+                lines.append('    ticks += %d' % inline_ticks)
+            lines.append('    return')
+    if ticks is not None:
+        lines.append('pc = %d' % addr)
+    if inline_ticks:
+        lines.append('ticks += %d' % inline_ticks)
+    src = 'def block():\n    %s\n' % i8080_gen.GLOBALS
+    src += ''.join('    %s\n' % line for line in lines)
+    namespace = {}
+    exec(compile(src, '<block %s>' % cpu.dec2hex16(start), 'exec'), cpu.__dict__, namespace)
+    block = namespace['block']
+    if start in traps:
+        block = trapped(traps[start], block)
+    elif loops:
+        block, end = loops(start, block, end)
+    blocks[start] = block
+    block_end[start] = end
+    for page in range(start >> 8, ((end - 1) >> 8) + 1):
+        if not page_blocks[page]:
+            cpu.watch_code(page, True)
+        page_blocks[page].add(start)
+    return block
+
+
+def trapped(trap, block):
+    # Block running trap, or the code itself when trap returns False
+    def run_trap():
+        if not trap():
+            block()
+    return run_trap
+
+
+def drop(start):
+    # Remove block from the cache
+    del blocks[start]
+    end = block_end.pop(start)
+    for page in range(start >> 8, ((end - 1) >> 8) + 1):
+        page_blocks[page].discard(start)
+        if not page_blocks[page]:
+            cpu.watch_code(page, False)
+
+
+def invalidate(addr):
+    # write_mem() hook: drop every block containing written address
+    for start in [s for s in page_blocks[addr >> 8] if s <= addr < block_end[s]]:
+        drop(start)
+        cpu.code_dirty = True
+
+
+def flush():
+    # Drop all blocks, e.g. after loading memory bypassing write_mem()
+    for start in list(blocks):
+        drop(start)
+
+
+def flush_page(page):
+    # Drop blocks of one page changed bypassing write_mem()
+    for start in list(page_blocks[page]):
+        drop(start)
+
+
+def set_lazy_flags(on):
+    # Switch flags evaluation mode, blocks are translated again for it
+    i8080_gen.set_lazy_flags(on)
+    flush()
+
+
+def core():
+    # Execute one translated block or a single instruction outside RAM and ROM
+    global deadline
+    deadline = cpu.ticks
+    block = blocks.get(cpu.pc)
+    if block is None:
+        if cpu.pc > CODE_TOP:
+            return cpu.core()
+        block = translate(cpu.pc)
+    block()
+    if cpu.code_dirty:
+        cpu.code_dirty = False
+
+
+def run(budget):
+    # Execute blocks until budget ticks are used, return ticks used
+    global deadline
+    start = cpu.ticks
+    end = deadline = start + budget
+    get = blocks.get
+    while cpu.ticks < end:
+        pc = cpu.pc
+        block = get(pc)
+        if block is None:
+            if pc > CODE_TOP:
+                cpu.core()
+                continue
+            block = translate(pc)
+        block()
+        if cpu.code_dirty:
+            cpu.code_dirty = False
+    return cpu.ticks - start
+
+
+cpu.code_written = invalidate
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Specialised handlers generator (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Every one of 256 opcodes gets its own handler with register indices and
+# branch conditions built in, so nothing is decoded from the opcode at run
+# time. Handler bodies are also used by the block translator (i8080_blocks),
+# which puts immediate operands into them as constants.
+
+import random
+
+import i8080 as cpu
+import spyc_keyboard
+
+# Instruction lengths
+length = [1] * 256
+for op in (0x06, 0x0e, 0x16, 0x1e, 0x26, 0x2e, 0x36, 0x3e, 0xc6, 0xce, 0xd6, 0xde, 0xe6, 0xee, 0xf6, 0xfe,
+           0xd3, 0xdb):
+    length[op] = 2
+for op in (0x01, 0x11, 0x21, 0x31, 0x22, 0x2a, 0x32, 0x3a, 0xc3, 0xcb, 0xcd, 0xdd, 0xed, 0xfd,
+           0xc2, 0xca, 0xd2, 0xda, 0xe2, 0xea, 0xf2, 0xfa, 0xc4, 0xcc, 0xd4, 0xdc, 0xe4, 0xec, 0xf4, 0xfc):
+    length[op] = 3
+
+# Branch conditions NZ, Z, NC, C, PO, PE, P, M
+conditions = ['not flag_z', 'flag_z', 'not flag_c', 'flag_c', 'not flag_p', 'flag_p', 'not flag_s', 'flag_s']
+lazy_conditions = ['not z_table[flag_res]', 'z_table[flag_res]', 'not flag_c', 'flag_c',
+                   'not lazy_p_table[flag_res]', 'lazy_p_table[flag_res]', 'not s_table[flag_res]', 's_table[flag_res]']
+
+alu = ['add_a', 'adc_a', 'sub_a', 'sbc_a', 'and_a', 'xor_a', 'or_a', 'cp_a']
+
+GLOBALS = 'global pc, sp, ticks, flag_c'
+
+
+def read(addr, offset=0):
+    # Expression of memory byte at addr + offset. Plain memory below
+    # cpu.read_top is read in place without read_mem() call if addr is a
+    # name, register pair or constant.
+    if addr.isdigit():
+        at = '%d' % ((int(addr) + offset) & 0xffff)
+        return '(memory[%s] if %s < read_top else read_mem(%s))' % (at, at, at)
+    if not addr.replace('[0]', '').isidentifier():
+        return 'read_mem((%s + %d) & 0xffff)' % (addr, offset) if offset else 'read_mem(%s)' % addr
+    if offset:
+        at = '%s + %d' % (addr, offset)
+        return '(memory[%s] if %s < read_top else read_mem((%s) & 0xffff))' % (at, at, at)
+    return '(memory[a] if (a := %s) < read_top else read_mem(a))' % addr
+
+
+def reg(r):
+    # Register code 0-7 (B, C, D, E, H, L, M, A) to Python expression
+    if r == 6:
+        return read('reg_hl[0]')
+    return 'reg_list[%d]' % (1 ^ r)
+
+
+def push(value):
+    # Lines pushing 16 bit value expression onto the stack
+    return ['sp = (sp - 2) & 0xffff',
+            'write_mem(sp, (%s) & 0xff)' % value,
+            'write_mem((sp + 1) & 0xffff, (%s) >> 8)' % value]
+
+
+def body(op, addr=None):
+    # Python lines of instruction op and its ticks, or lines and None for
+    # instructions setting pc and ticks by themselves (jumps, calls, returns).
+    # Without addr operands are read at run time relative to pc, with addr they
+    # are taken from memory now and built into lines as constants.
+    if addr is None:
+        n = read('pc', 1)
+        nn = '%s + %s * 256' % (read('pc', 1), read('pc', 2))
+        nn1 = '(%s + 1) & 0xffff' % nn
+        nxt = '(pc + %d) & 0xffff' % length[op]
+    else:
+        n = '%d' % cpu.memory[(addr + 1) & 0xffff]
+        value = cpu.memory[(addr + 2) & 0xffff] * 256 + cpu.memory[(addr + 1) & 0xffff]
+        nn = '%d' % value
+        nn1 = '%d' % ((value + 1) & 0xffff)
+        nxt = '%d' % ((addr + length[op]) & 0xffff)
+    d = (op >> 3) & 7
+    s = op & 7
+    rp = (op >> 4) & 3
+    cond = (lazy_conditions if cpu.lazy_flags else conditions)[d]
+
+    # 00 XXX XXX group
+    if op < 0x40:
+        low = op & 0x0f
+        if op & 7 == 0:  # NOP
+            return [], 4
+        if low == 0x01:  # LXI
+            return ['sp = %s' % nn if rp == 3 else 'rp_list[%d] = %s' % (rp, nn)], 10
+        if low == 0x09:  # DAD
+            return ['t = reg_hl[0] + %s' % ('sp' if rp == 3 else 'rp_list[%d]' % rp),
+                    'flag_c = t > 0xffff',
+                    'reg_hl[0] = t & 0xffff'], 10
+        if op in (0x02, 0x12):  # STAX
+            return ['write_mem(%s[0], reg_a[0])' % ('reg_bc', 'reg_de')[rp]], 7
+        if op in (0x0a, 0x1a):  # LDAX
+            return ['reg_a[0] = %s' % read(('reg_bc[0]', 'reg_de[0]')[rp])], 7
+        if op == 0x22:  # SHLD
+            return ['write_mem(%s, reg_l[0])' % nn, 'write_mem(%s, reg_h[0])' % nn1], 16
+        if op == 0x2a:  # LHLD
+            return ['reg_l[0] = %s' % read(nn), 'reg_h[0] = %s' % read(nn1)], 16
+        if op == 0x32:  # STA
+            return ['write_mem(%s, reg_a[0])' % nn], 13
+        if op == 0x3a:  # LDA
+            return ['reg_a[0] = %s' % read(nn)], 13
+        if low == 0x03:  # INX
+            return ['sp = (sp + 1) & 0xffff' if rp == 3 else 'rp_list[%d] = (rp_list[%d] + 1) & 0xffff' % (rp, rp)], 5
+        if low == 0x0b:  # DCX
+            return ['sp = (sp - 1) & 0xffff' if rp == 3 else 'rp_list[%d] = (rp_list[%d] - 1) & 0xffff' % (rp, rp)], 6
+        if s == 4:  # INR
+            if d == 6:
+                return ['write_mem(reg_hl[0], inc_reg(%s))' % reg(6)], 10
+            return ['%s = inc_reg(%s)' % (reg(d), reg(d))], 5
+        if s == 5:  # DCR
+            if d == 6:
+                return ['write_mem(reg_hl[0], dec_reg(%s))' % reg(6)], 10
+            return ['%s = dec_reg(%s)' % (reg(d), reg(d))], 5
+        if s == 6:  # MVI
+            if d == 6:
+                return ['write_mem(reg_hl[0], %s)' % n], 10
+            return ['%s = %s' % (reg(d), n)], 7
+        if op == 0x07:  # RLC
+            return ['t = reg_a[0] << 1', 'flag_c = t > 0xff', 'reg_a[0] = (t | flag_c) & 0xff'], 4
+        if op == 0x0f:  # RRC
+            return ['t = reg_a[0]', 'flag_c = bool(t & 1)', 'reg_a[0] = t >> 1 | (t & 1) << 7'], 4
+        if op == 0x17:  # RAL
+            return ['t = reg_a[0] << 1 | flag_c', 'flag_c = t > 0xff', 'reg_a[0] = t & 0xff'], 4
+        if op == 0x1f:  # RAR
+            return ['t = reg_a[0]', 'reg_a[0] = t >> 1 | flag_c << 7', 'flag_c = bool(t & 1)'], 4
+        if op == 0x27:  # DAA
+            return ['daa()'], 4
+        if op == 0x2f:  # CMA
+            return ['reg_a[0] ^= 0xff'], 4
+        if op == 0x37:  # STC
+            return ['flag_c = True'], 4
+        if op == 0x3f:  # CMC
+            return ['flag_c = not flag_c'], 4
+
+    # 01 XXX XXX group
+    if op < 0x80:
+        if op == 0x76:  # HLT
+            return [], 4
+        if s == 6:
+            return ['%s = %s' % (reg(d), reg(6))], 7
+        if d == 6:
+            return ['write_mem(reg_hl[0], %s)' % reg(s)], 7
+        return ['%s = %s' % (reg(d), reg(s))], 5
+
+    # 10 XXX XXX group
+    if op < 0xc0:
+        return ['%s(%s)' % (alu[d], reg(s))], 7 if s == 6 else 4
+
+    # 11 XXX XXX group
+    if s == 0:  # Rcc
+        return ['if %s:' % cond,
+                '    pc = read_mem(sp) + read_mem((sp + 1) & 0xffff) * 256',
+                '    sp = (sp + 2) & 0xffff',
+                '    ticks += 11',
+                'else:',
+                '    pc = %s' % nxt,
+                '    ticks += 5'], None
+    if s == 2:  # Jcc
+        return ['if %s:' % cond,
+                '    pc = %s' % nn,
+                'else:',
+                '    pc = %s' % nxt,
+                'ticks += 10'], None
+    if s == 4:  # Ccc
+        return (['if %s:' % cond] +
+                ['    ' + line for line in push(nxt)] +
+                ['    pc = %s' % nn,
+                 '    ticks += 17',
+                 'else:',
+                 '    pc = %s' % nxt,
+                 '    ticks += 11']), None
+    if s == 6:  # ALU immediate
+        return ['%s(%s)' % (alu[d], n)], 7
+    if s == 7:  # RST
+        return push(nxt) + ['pc = %d' % (d * 8), 'ticks += 11'], None
+    if op == 0xf1:  # POP PSW
+        return ['reg_f[0] = read_mem(sp)',
+                'f2flags()',
+                'reg_a[0] = read_mem((sp + 1) & 0xffff)',
+                'sp = (sp + 2) & 0xffff'], 10
+    if s == 1 and not d & 1:  # POP
+        return ['rp_list[%d] = read_mem((sp + 1) & 0xffff) * 256 + read_mem(sp)' % rp,
+                'sp = (sp + 2) & 0xffff'], 10
+    if op == 0xf5:  # PUSH PSW
+        return ['flags2f()',
+                'sp = (sp - 2) & 0xffff',
+                'write_mem(sp, reg_f[0])',
+                'write_mem((sp + 1) & 0xffff, reg_a[0])'], 11
+    if s == 5 and not d & 1:  # PUSH
+        return push('rp_list[%d]' % rp), 11
+    if op in (0xc9, 0xd9):  # RET
+        return ['pc = read_mem(sp) + read_mem((sp + 1) & 0xffff) * 256',
+                'sp = (sp + 2) & 0xffff',
+                'ticks += 10'], None
+    if op == 0xe9:  # PCHL
+        return ['pc = reg_hl[0]', 'ticks += 5'], None
+    if op == 0xf9:  # SPHL
+        return ['sp = reg_hl[0]'], 5
+    if op in (0xc3, 0xcb):  # JMP
+        return ['pc = %s' % nn, 'ticks += 10'], None
+    if op in (0xcd, 0xdd, 0xed, 0xfd):  # CALL
+        return push(nxt) + ['pc = %s' % nn, 'ticks += 17'], None
+    if op == 0xd3:  # OUT
+        return ['write_port(reg_a[0] * 256 + %s, reg_a[0])' % n], 10
+    if op == 0xdb:  # IN
+        return ['reg_a[0] = read_port(reg_a[0] * 256 + %s)' % n], 10
+    if op == 0xe3:  # XTHL
+        return ['t = read_mem(sp)',
+                'carry = read_mem((sp + 1) & 0xffff)',
+                'write_mem(sp, reg_l[0])',
+                'write_mem((sp + 1) & 0xffff, reg_h[0])',
+                'reg_l[0] = t',
+                'reg_h[0] = carry'], 18
+    if op == 0xeb:  # XCHG
+        return ['reg_de[0], reg_hl[0] = reg_hl[0], reg_de[0]'], 5
+    if op in (0xf3, 0xfb):  # DI, EI
+        return [], 4
+
+
+def handler_source(op):
+    # Python source of specialised handler for opcode op
+    lines, ticks = body(op)
+    if ticks is not None:
+        if op != 0x76:  # HLT stays on its own address
+            lines = lines + ['pc = (pc + %d) & 0xffff' % length[op]]
+        lines = lines + ['ticks += %d' % ticks]
+    return 'def h_%02X():\n    %s\n' % (op, GLOBALS) + ''.join('    %s\n' % line for line in lines)
+
+
+def build():
+    # Compile all 256 handlers in CPU module namespace for current flags mode
+    namespace = {}
+    for op in range(256):
+        exec(compile(handler_source(op), '<h_%02X>' % op, 'exec'), cpu.__dict__, namespace)
+    return [namespace['h_%02X' % op] for op in range(256)]
+
+
+handlers = build()
+cpu.dispatch = handlers
+
+
+def set_lazy_flags(on):
+    # Switch flags evaluation mode and rebuild handlers for it
+    cpu.set_lazy_flags(on)
+    handlers[:] = build()
+
+
+def machine_state():
+    # Everything an instruction can change
+    cpu.flags2f()
+    return (bytes(cpu.memory), bytes(cpu.regfile), cpu.pc, cpu.sp, cpu.ticks,
+            cpu.flag_c, cpu.flag_p, cpu.flag_h, cpu.flag_z, cpu.flag_s,
+            bytes(spyc_keyboard.kb_mem), spyc_keyboard.vv55a_mode)
+
+
+def set_machine_state(state):
+    cpu.memory[:] = state[0]
+    cpu.regfile[:] = state[1]
+    cpu.pc, cpu.sp, cpu.ticks, cpu.flag_c, cpu.flag_p, cpu.flag_h, cpu.flag_z, cpu.flag_s = state[2:10]
+    spyc_keyboard.kb_mem[:] = state[10]
+    spyc_keyboard.vv55a_mode = state[11]
+    spyc_keyboard.update_ports()
+
+
+def run_handler(handler):
+    # Machine state after handler, reading unmapped I/O addresses included
+    try:
+        handler()
+    except TypeError:
+        return None
+    return machine_state()
+
+
+def verify(rounds=20):
+    # Compare specialised handlers in both flags modes and reference ones in
+    # lazy flags mode with the reference ones in cpu.opcodes using eager
+    # flags on random machine states.
+    # Return list of failed (opcode, lazy flags, specialised) triples.
+    lazy = cpu.lazy_flags
+    set_lazy_flags(False)
+    saved = machine_state()
+    failed = []
+    for specialised, mode in ((True, False), (True, True), (False, True)):
+        set_lazy_flags(mode)
+        tested = list(handlers) if specialised else [cpu.opcodes[op] for op in range(256)]
+        cpu.set_lazy_flags(False)
+        for op in range(256):
+            for _ in range(rounds):
+                cpu.memory[:0xc000] = random.randbytes(0xc000)
+                cpu.regfile[:] = random.randbytes(8)
+                cpu.pc = random.randrange(0xbffd)
+                cpu.sp = random.randrange(0x10000)
+                cpu.flag_c, cpu.flag_p, cpu.flag_h, cpu.flag_z, cpu.flag_s = (random.random() < 0.5 for _ in range(5))
+                cpu.memory[cpu.pc] = op
+                state = machine_state()
+                cpu.opcode = op
+                expected = run_handler(cpu.opcodes[op])
+                set_machine_state(state)
+                cpu.set_lazy_flags(mode)
+                if mode:  # Only carry is live in its global in lazy flags mode, the others go stale
+                    cpu.flag_p, cpu.flag_h, cpu.flag_z, cpu.flag_s = (
+                        not cpu.flag_p, not cpu.flag_h, not cpu.flag_z, not cpu.flag_s)
+                result = run_handler(tested[op])
+                cpu.set_lazy_flags(False)
+                if result != expected:
+                    failed.append((op, mode, specialised))
+                    break
+    set_machine_state(saved)
+    set_lazy_flags(lazy)
+    return failed
+
+
+if __name__ == '__main__':
+    errors = verify()
+    print('Handlers:', 'all match' if not errors else 'mismatch ' + ' '.join(
+        cpu.dec2hex8(op) + (' (lazy flags)' if lazy else '') + ('' if specialised else ' (reference)')
+        for op, lazy, specialised in errors))
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Loop skipping (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Blocks starting loops are wrapped when i8080_blocks translates them.
+#
+# Delay loop counts a register down to zero and does nothing else:
+#   DCR r / JNZ start  or  DCX rp / MOV A,hi / ORA lo / JNZ start
+# After the first round the counter jumps over all rounds but the last one
+# fitting in the time left, then that round runs as usual.
+#
+# Fill and copy loop stores a register to (HL), (BC) or (DE), loaded first
+# from another pair for copy, possibly a few times per round, steps the
+# pairs and counts down with DCR r or DCX rp / MOV A,hi / ORA lo:
+#   MOV M,A / INX H / INX D / DCR C / JNZ start
+#   LDAX D / MOV M,A / INX H / INX D / LDAX D / MOV M,A / INX H / INX D / DCR C / JNZ start
+# Its rounds, up to the same last one, are one slice assignment to
+# i8080.memory. Bytes behind devices, ROM or translated code are never
+# touched this way: rounds reaching them run as usual and go through
+# write_mem(), video column marking and self-modifying code checks
+# included.
+#
+# Polling loop is a cycle of up to MAX_CYCLE blocks with jumps only and no
+# memory writes, e.g. ROM waiting for tape or a key. If a round brings it
+# back to the start with the same registers and flags, only input can get
+# it out, so whole rounds are skipped up to i8080_blocks.deadline or the
+# next input change.
+#
+# In all cases ticks grow exactly as if every round ran, so events keep their
+# time. Emulation gets to frame end sooner and the host sleeps the rest.
+#
+#   python i8080_loops.py
+#
+# compares skipping with running every round on random loops.
+
+import random
+
+import i8080 as cpu
+import i8080_blocks
+import i8080_gen
+
+MAX_CYCLE = 4  # Blocks in polling loop
+WINDOW = 0x100  # Bytes from polling loop start its blocks begin within
+GIVE_UP = 16  # Rounds in a row changing registers which make polling loop a plain block
+next_input = None  # Returns ticks of the next input change not known to run() caller, e.g. tape edge, or None
+
+reg_views = (cpu.reg_b, cpu.reg_c, cpu.reg_d, cpu.reg_e, cpu.reg_h, cpu.reg_l, None, cpu.reg_a)
+pair_views = (cpu.reg_bc, cpu.reg_de, cpu.reg_hl)
+conditional_jumps = (0xc2, 0xca, 0xd2, 0xda, 0xe2, 0xea, 0xf2, 0xfa)
+jumps = (0xc3, 0xcb)
+
+# Instructions with effects beyond registers and flags, or going to
+# addresses not known at translation
+no_polling = bytearray(i8080_blocks.writes_mem)
+for op in range(256):
+    if i8080_blocks.ends_block[op] and op not in conditional_jumps + jumps:
+        no_polling[op] = 1
+no_polling[0xd3] = no_polling[0xdb] = 1  # OUT, IN
+
+
+def word(addr):
+    return cpu.memory[addr + 1] | cpu.memory[addr + 2] << 8
+
+
+def delay_counter(start, end):
+    # Register view counting delay loop rounds, None if block is not one
+    code = bytes(cpu.memory[start:end])
+    if len(code) < 4 or code[-3:] != bytes((0xc2, start & 0xff, start >> 8)):
+        return None
+    if len(code) == 4 and code[0] & 0xc7 == 0x05 and code[0] != 0x35:  # DCR r
+        return reg_views[code[0] >> 3]
+    if len(code) == 6 and code[0] & 0xcf == 0x0b and code[0] != 0x3b:  # DCX rp
+        high, low = code[0] >> 3 & 6, (code[0] >> 3 & 6) + 1
+        if code[1:3] in (bytes((0x78 | high, 0xb0 | low)), bytes((0x78 | low, 0xb0 | high))):
+            return pair_views[code[0] >> 4]
+    return None
+
+
+def delay(start, block, counter):
+    # Block of delay loop skipping to its last rounds before deadline
+    def run_loop():
+        before = cpu.ticks
+        block()
+        left = i8080_blocks.deadline - cpu.ticks
+        if cpu.pc != start or left <= 0:
+            return
+        period = cpu.ticks - before
+        skip = min(counter[0], (left + period - 1) // period) - 1
+        if skip > 0:
+            counter[0] -= skip
+            cpu.ticks += skip * period
+            block()
+    return run_loop
+
+
+def transfer_shape(start, end):
+    # Fill or copy loop block: value register stored every time, pair it is
+    # loaded from (None for fill) and direction, pair it is stored to and
+    # direction, bytes stored in one round, pair -> step in one round and
+    # counter view. None if block is not such a loop.
+    code = bytes(cpu.memory[start:end])
+    if len(code) < 5 or code[-3:] != bytes((0xc2, start & 0xff, start >> 8)):
+        return None
+    ops = list(code[:-3])
+    if any(i8080_gen.length[op] != 1 for op in ops):
+        return None
+    counter = None
+    if len(ops) >= 4 and ops[-2] & 0xf8 == 0x78 and ops[-1] & 0xf8 == 0xb0:  # MOV A,x / ORA y
+        pair = (ops[-2] & 7) >> 1
+        if pair < 3 and {ops[-2] & 7, ops[-1] & 7} == {pair * 2, pair * 2 + 1} and 0x0b | pair << 4 in ops[:-2]:
+            ops = ops[:-2]
+            ops.remove(0x0b | pair << 4)
+            counter = pair, (pair * 2, pair * 2 + 1)
+    steps = {}  # Pair -> its change since the round start
+    loads = []  # (pair, offset, register)
+    stores = []
+    order = []  # Loads and stores
+    for op in ops:
+        if op in (0x0a, 0x1a) or op & 0xc7 == 0x46 and op != 0x76:  # LDAX B, LDAX D, MOV r,M
+            pair, reg = (op >> 4, 7) if op & 0xc7 != 0x46 else (2, op >> 3 & 7)
+            loads.append((pair, steps.get(pair, 0), reg))
+            order.append(loads)
+        elif op in (0x02, 0x12) or op & 0xf8 == 0x70 and op != 0x76:  # STAX B, STAX D, MOV M,r
+            pair, reg = (op >> 4, 7) if op & 0xf8 != 0x70 else (2, op & 7)
+            stores.append((pair, steps.get(pair, 0), reg))
+            order.append(stores)
+        elif op & 0xc7 == 0x03 and op >> 4 < 3:  # INX rp, DCX rp
+            steps[op >> 4] = steps.get(op >> 4, 0) + (1 if op & 8 == 0 else -1)
+        elif op & 0xc7 == 0x05 and op != 0x35 and counter is None:  # DCR r
+            counter = None, (op >> 3 & 7,)
+        else:
+            return None
+    if not stores or counter is None or loads and order != [loads, stores] * len(stores):
+        return None  # Copy is load, store, load, store...
+    value = stores[0][2]
+    if any(access[2] != value for access in loads + stores):
+        return None
+    directions = []
+    for accesses in (loads, stores):
+        if not accesses:
+            directions += [None, 0]
+            continue
+        pair = accesses[0][0]
+        direction = steps.get(pair, 0) // len(accesses)
+        if abs(direction) != 1 or accesses != [(pair, direction * i, value) for i in range(len(accesses))] or \
+                steps[pair] != direction * len(accesses):
+            return None
+        directions += [pair, direction]
+    if directions[0] == directions[2]:
+        return None
+    pointers = {reg for pair in steps for reg in (pair * 2, pair * 2 + 1)}
+    counted = set(counter[1])
+    if pointers & counted or value in pointers | counted:
+        return None
+    if counter[0] is not None and value == 7 and not loads:
+        return None  # MOV A,x changes value to fill with
+    view = pair_views[counter[0]] if counter[0] is not None else reg_views[counter[1][0]]
+    return (value, *directions, len(stores), steps, view)
+
+
+def plain_bytes(addr, step, pages, limit):
+    # Bytes going from addr by step which are all in pages without device
+    # or translated code in pages map, up to limit
+    count = 0
+    while count < limit and 0 <= addr <= 0xffff and pages[addr >> 8] is None:
+        left = 0x100 - (addr & 0xff) if step > 0 else (addr & 0xff) + 1
+        count += left
+        addr += step * left
+    return min(count, limit)
+
+
+def transfer(start, block, value, load, load_step, store, step, unrolled, steps, counter):
+    # Block of fill or copy loop doing all rounds but the last one fitting
+    # before deadline with one slice assignment. Rounds touching I/O,
+    # translated code or other devices run as usual.
+    destination = pair_views[store]
+    source = pair_views[load] if load is not None else None
+    byte = reg_views[value]
+    moves = [(pair_views[pair], change) for pair, change in steps.items()]
+
+    def run_loop():
+        before = cpu.ticks
+        block()
+        left = i8080_blocks.deadline - cpu.ticks
+        if cpu.pc != start or left <= 0:
+            return
+        period = cpu.ticks - before
+        rounds = min(counter[0], (left + period - 1) // period) - 1
+        size = plain_bytes(destination[0], step, cpu.write_map, rounds * unrolled)
+        if source is None:
+            rounds = size // unrolled
+            if rounds <= 0:
+                return
+            data = bytes((byte[0],)) * (rounds * unrolled)
+        else:
+            size = plain_bytes(source[0], load_step, cpu.read_map, size)
+            behind = (destination[0] - source[0]) * step
+            if load_step == step and 0 < behind < size:
+                size = behind  # Later bytes are read after earlier ones are written
+            rounds = size // unrolled
+            if rounds <= 0:
+                return
+            size = rounds * unrolled
+            low = source[0] if load_step > 0 else source[0] - size + 1
+            data = bytes(cpu.memory[low:low + size])
+            if load_step != step:
+                if low < destination[0] + size and destination[0] - size < low + size:
+                    return  # Opposite directions over the same bytes
+                data = data[::-1]
+        low = destination[0] if step > 0 else destination[0] - len(data) + 1
+        cpu.memory[low:low + len(data)] = data
+        for view, change in moves:
+            view[0] = (view[0] + change * rounds) & 0xffff
+        counter[0] -= rounds
+        cpu.ticks += rounds * period
+        block()
+    return run_loop
+
+
+def successors(start):
+    # Address after block at start and addresses going after it, None for
+    # both if they are not known or block has effects polling loop must not
+    # have. Block ends where i8080_blocks ends it.
+    addr = start
+    for count in range(i8080_blocks.MAX_BLOCK):
+        op = cpu.memory[addr]
+        if no_polling[op]:
+            return None, None
+        end = addr + i8080_gen.length[op]
+        if op in jumps:
+            return end, (word(addr),)
+        if op in conditional_jumps:
+            return end, (word(addr), end)
+        addr = end
+        if addr > i8080_blocks.CODE_TOP:
+            break
+    return end, (end,)
+
+
+def find_cycle(start):
+    # Blocks of polling loop beginning at start, which has to be the lowest
+    # address of them: address -> block end. None if there is no such loop.
+    code = bytes(cpu.memory[start:start + WINDOW + 2])
+    back = bytes((start & 0xff, start >> 8))
+    found = code.find(back, 1)
+    while found > 0 and code[found - 1] not in conditional_jumps + jumps:
+        found = code.find(back, found + 1)
+    if found < 0:
+        return None  # No jump back to start
+    known = {}  # Address -> successors() of it
+    cycle = set()
+
+    def walk(addr, path):
+        # Put blocks of paths from addr back to start into cycle
+        if addr == start and path:
+            cycle.update(path)
+            return
+        if addr in path or len(path) >= MAX_CYCLE or not start <= addr < min(start + WINDOW, i8080_blocks.CODE_TOP + 1):
+            return
+        if addr not in known:
+            known[addr] = successors(addr)
+        for target in known[addr][1] or ():
+            walk(target, path + [addr])
+
+    walk(start, [])
+    if not cycle:
+        return None
+    return {addr: known[addr][0] for addr in cycle}
+
+
+def state():
+    # Registers and flags
+    cpu.flags2f()
+    return bytes(cpu.regfile), cpu.sp
+
+
+def polling(start, head, members):
+    # Block of polling loop skipping rounds which change nothing. Loop
+    # changing registers GIVE_UP rounds in a row is left to run as is.
+    get = i8080_blocks.blocks.get
+    misses = 0
+
+    def run_round():
+        # One round from start back to it, False if it leaves the loop or
+        # reaches deadline
+        block = head
+        while True:
+            block()
+            pc = cpu.pc
+            if pc not in members or cpu.ticks >= i8080_blocks.deadline:
+                return False
+            if pc == start:
+                return True
+            block = get(pc) or i8080_blocks.translate(pc)
+
+    def run_loop():
+        nonlocal misses
+        registers = cpu.regfile[:7], cpu.sp  # F is not up to date
+        if not run_round():
+            return
+        if (cpu.regfile[:7], cpu.sp) != registers:
+            misses += 1
+            if misses >= GIVE_UP:
+                i8080_blocks.blocks[start] = head
+            return
+        misses = 0
+        before = state()
+        ticks = cpu.ticks
+        if not run_round() or state() != before:
+            return
+        period = cpu.ticks - ticks
+        bound = i8080_blocks.deadline
+        wake = next_input() if next_input else None
+        if wake is not None:
+            bound = min(bound, wake)
+        if bound > cpu.ticks:
+            cpu.ticks += (bound - cpu.ticks - 1) // period * period
+    return run_loop
+
+
+def wrap(start, block, end):
+    # i8080_blocks.loops hook: loop block and the end of code it covers
+    counter = delay_counter(start, end)
+    if counter is not None:
+        return delay(start, block, counter), end
+    shape = transfer_shape(start, end)
+    if shape is not None:
+        return transfer(start, block, *shape), end
+    cycle = find_cycle(start)
+    if cycle is None:
+        return block, end
+    return polling(start, block, set(cycle)), max(cycle.values())
+
+
+def set_loop_skipping(on):
+    # Skip loop rounds (on) or run every round, blocks are translated again
+    i8080_blocks.loops = wrap if on else None
+    i8080_blocks.flush()
+
+
+def random_program():
+    # Loop at 100h of a random kind: its name and code, 2000h is polled
+    kind = random.choice(('delay', 'delay pair', 'polling', 'polling cycle', 'counting', 'fill', 'fill pair', 'copy',
+                          'copy pair'))
+    steps = [random.choice((0x03, 0x0b)) for _ in range(2)]  # INX or DCX
+    if kind == 'fill':
+        # MOV M,r / step H / maybe step D / DCR r / JNZ 100h / JMP 100h
+        value, count = random.sample((0, 1, 2, 3, 7), 2)
+        if count == 7:
+            count = 1
+        other = (steps[1] | 0x10,) if value < 2 and count < 2 and random.random() < 0.5 else ()
+        return kind, bytes((0x70 | value, steps[0] | 0x20) + other + (0x05 | count << 3, 0xc2, 0x00, 0x01,
+                                                                      0xc3, 0x00, 0x01))
+    if kind == 'fill pair':
+        # MOV M,D or E / step H / DCX B / MOV A,B / ORA C / JNZ 100h / JMP 100h
+        return kind, bytes((0x70 | random.choice((2, 3)), steps[0] | 0x20, 0x0b, 0x78, 0xb1, 0xc2, 0x00, 0x01,
+                            0xc3, 0x00, 0x01))
+    if kind == 'copy':
+        # LDAX D / MOV M,A / step D / step H once or twice / DCR B or C / JNZ 100h / JMP 100h
+        body = (0x1a, 0x77, steps[0] | 0x10, steps[1] | 0x20) * random.choice((1, 2))
+        return kind, bytes(body + (random.choice((0x05, 0x0d)), 0xc2, 0x00, 0x01, 0xc3, 0x00, 0x01))
+    if kind == 'copy pair':
+        # MOV A,M / STAX D / step H / step D / DCX B / MOV A,C / ORA B / JNZ 100h / JMP 100h
+        return kind, bytes((0x7e, 0x12, steps[0] | 0x20, steps[1] | 0x10, 0x0b, 0x79, 0xb0, 0xc2, 0x00, 0x01,
+                            0xc3, 0x00, 0x01))
+    if kind == 'delay':
+        return kind, bytes((0x05 | random.choice((0, 1, 2, 3, 4, 5, 7)) << 3, 0xc2, 0x00, 0x01, 0xc3, 0x00, 0x01))
+    if kind == 'delay pair':
+        pair = random.randrange(3)
+        high, low = random.sample((pair * 2, pair * 2 + 1), 2)
+        return kind, bytes((0x0b | pair << 4, 0x78 | high, 0xb0 | low, 0xc2, 0x00, 0x01, 0xc3, 0x00, 0x01))
+    if kind == 'polling':
+        # LDA 2000h / ORA A / JZ 100h / JMP $
+        return kind, bytes((0x3a, 0x00, 0x20, 0xb7, 0xca, 0x00, 0x01, 0xc3, 0x07, 0x01))
+    if kind == 'polling cycle':
+        # As ROM waits for tape: LDA 2000h / CPI 80h / JC 10Eh / ANI 1 / CMP E / JZ 100h / JMP $
+        return kind, bytes((0x3a, 0x00, 0x20, 0xfe, 0x80, 0xda, 0x0e, 0x01, 0xe6, 0x01, 0xbb, 0xca, 0x00, 0x01,
+                            0xc3, 0x0e, 0x01))
+    # INR B / JNZ 100h / JMP 100h changes registers every round
+    return kind, bytes((0x04, 0xc2, 0x00, 0x01, 0xc3, 0x00, 0x01))
+
+
+def verify(rounds=200):
+    # Run random loops with and without skipping, return names of loop
+    # kinds with different results
+    failed = set()
+    saved = i8080_gen.machine_state()
+    lazy = cpu.lazy_flags
+    i8080_blocks.set_lazy_flags(False)
+    skipping = i8080_blocks.loops
+    for _ in range(rounds):
+        kind, code = random_program()
+        cpu.memory[0x200:0xc000] = random.randbytes(0xbe00)
+        cpu.memory[0x100:0x100 + len(code)] = code
+        cpu.memory[0x2000] = random.choice((0, random.randrange(256)))
+        cpu.regfile[:] = random.randbytes(8)
+        cpu.f2flags()
+        cpu.pc = 0x100
+        cpu.sp = random.randrange(0x10000)
+        # Fill and copy overlapping or not, in RAM and ROM, away from the loop
+        cpu.reg_hl[0] = random.randrange(0x1000, 0xe000)
+        cpu.reg_de[0] = random.choice((cpu.reg_hl[0] + random.randrange(-300, 300), random.randrange(0x1000, 0xe000)))
+        cpu.ticks = random.randrange(1000)
+        state = i8080_gen.machine_state()
+        budget = random.randrange(1, 100000)
+        results = []
+        for on in (False, True):
+            i8080_gen.set_machine_state(state)
+            set_loop_skipping(on)
+            i8080_blocks.translate(0x3000)  # Translated code in the way of fill or copy
+            results.append(i8080_gen.run_handler(lambda: i8080_blocks.run(budget)))
+        if results[0] != results[1]:
+            failed.add(kind)
+    i8080_gen.set_machine_state(saved)
+    i8080_blocks.loops = skipping
+    i8080_blocks.set_lazy_flags(lazy)
+    return failed
+
+
+if __name__ == '__main__':
+    failed = verify()
+    print('Loop skipping: ' + ('all match' if not failed else 'differ in ' + ', '.join(sorted(failed))))
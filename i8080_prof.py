@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Guest profiler (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# set_profiling(True) puts counting wrappers into cpu.dispatch, so core() and
+# run() pay for profiling only while it is on. Translated blocks of
+# i8080_blocks do not go through dispatch, profile with cpu.run() instead.
+#
+# With calls=True taken CALL, RST and RET instructions also keep a shadow
+# call stack: every subroutine entry address gets its calls number, inclusive
+# ticks (with callees) and exclusive ticks (own code only). A return goes to
+# the frame whose return address it matches, so returns after stack tricks
+# of the guest program that match nothing are ignored.
+
+from array import array
+
+import numpy as np
+
+import i8080 as cpu
+
+MAX_DEPTH = 64  # Deeper calls are not tracked
+
+op_count = array('Q', bytes(8 * 256))  # Executions of every opcode
+op_ticks = array('Q', bytes(8 * 256))  # Ticks spent in every opcode
+pc_count = array('Q', bytes(8 * 65536))  # Instructions executed at every address
+pc_ticks = array('Q', bytes(8 * 65536))  # Ticks spent at every address
+
+original = None  # Dispatch table replaced while profiling
+call_graph = False  # Calls and returns are followed
+
+# Call graph
+clock = 0  # Ticks since profiling start, cpu.ticks is reset every frame
+mark = 0  # Clock of the last call or return
+stack = [(None, None, 0, (None,))]  # Frames (entry, return address, clock at entry, path of entries)
+active = {}  # Entry -> number of its frames in stack, for recursion
+calls = {}  # Entry -> number of calls
+inclusive = {}  # Entry -> ticks with callees
+exclusive = {}  # Entry -> ticks of own code
+folded = {}  # Path of entries -> exclusive ticks
+symbols = {}  # Address -> routine name
+
+
+def wrap(op, table):
+    # Handler of opcode op counting the call of table[op]. Table is looked up
+    # on every call, so handlers rebuilt in place (i8080_gen.set_lazy_flags)
+    # are profiled as well.
+    def profiled():
+        addr = cpu.pc
+        start = cpu.ticks
+        table[op]()
+        spent = cpu.ticks - start
+        op_count[op] += 1
+        op_ticks[op] += spent
+        pc_count[addr] += 1
+        pc_ticks[addr] += spent
+    return profiled
+
+
+def wrap_calls(op, table):
+    # wrap() also moving clock and following CALL, RST and RET
+    handler = cpu.opcodes[op]
+    if handler in (cpu.b11001101, cpu.b11000100, cpu.b11000111):
+        size = 1 if handler is cpu.b11000111 else 3
+
+        def profiled():
+            global clock
+            addr = cpu.pc
+            start = cpu.ticks
+            sp = cpu.sp
+            table[op]()
+            spent = cpu.ticks - start
+            op_count[op] += 1
+            op_ticks[op] += spent
+            pc_count[addr] += 1
+            pc_ticks[addr] += spent
+            clock += spent
+            if cpu.sp == (sp - 2) & 0xffff:
+                enter(cpu.pc, (addr + size) & 0xffff)
+    elif handler in (cpu.b11001001, cpu.b11000000):
+        def profiled():
+            global clock
+            addr = cpu.pc
+            start = cpu.ticks
+            sp = cpu.sp
+            table[op]()
+            spent = cpu.ticks - start
+            op_count[op] += 1
+            op_ticks[op] += spent
+            pc_count[addr] += 1
+            pc_ticks[addr] += spent
+            clock += spent
+            if cpu.sp == (sp + 2) & 0xffff:
+                leave(cpu.pc)
+    else:
+        def profiled():
+            global clock
+            addr = cpu.pc
+            start = cpu.ticks
+            table[op]()
+            spent = cpu.ticks - start
+            op_count[op] += 1
+            op_ticks[op] += spent
+            pc_count[addr] += 1
+            pc_ticks[addr] += spent
+            clock += spent
+    return profiled
+
+
+def account():
+    # Give ticks since the last call or return to the running routine
+    global mark
+    elapsed = clock - mark
+    mark = clock
+    entry, path = stack[-1][0], stack[-1][3]
+    exclusive[entry] = exclusive.get(entry, 0) + elapsed
+    folded[path] = folded.get(path, 0) + elapsed
+
+
+def enter(entry, ret):
+    # Subroutine call
+    if len(stack) > MAX_DEPTH:
+        return
+    account()
+    stack.append((entry, ret, clock, stack[-1][3] + (entry,)))
+    active[entry] = active.get(entry, 0) + 1
+    calls[entry] = calls.get(entry, 0) + 1
+
+
+def leave(addr):
+    # Return to addr, drop frames up to the one which was called from there
+    for depth in range(len(stack) - 1, 0, -1):
+        if stack[depth][1] == addr:
+            break
+    else:
+        return
+    account()
+    while len(stack) > depth:
+        entry, ret, start, path = stack.pop()
+        active[entry] -= 1
+        if not active[entry]:
+            inclusive[entry] = inclusive.get(entry, 0) + clock - start
+
+
+def set_profiling(on, calls=False):
+    # Swap dispatch table for counting wrappers (on) or back, with calls
+    # build call graph as well
+    global original, call_graph
+    if on and original is None:
+        original = cpu.dispatch
+        cpu.dispatch = [(wrap_calls if calls else wrap)(op, original) for op in range(256)]
+        call_graph = calls
+    elif not on and original is not None:
+        cpu.dispatch = original
+        original = None
+
+
+def reset():
+    # Clear all counters and call stack
+    global clock, mark
+    for counters in (op_count, op_ticks, pc_count, pc_ticks):
+        counters[:] = array(counters.typecode, bytes(8 * len(counters)))
+    clock = mark = 0
+    del stack[1:]
+    for table in (active, calls, inclusive, exclusive, folded):
+        table.clear()
+
+
+def load_symbols(filename):
+    # Read routine names, one "address name" pair per line, address in hex
+    # as C800, #C800, 0xC800 or C800h, ";" starts a comment
+    with open(filename) as f:
+        for line in f:
+            fields = line.split(';')[0].replace(':', ' ').replace('=', ' ').split()
+            if len(fields) >= 2:
+                addr = fields[0].lstrip('#').lower()
+                if addr.endswith('h'):
+                    addr = addr[:-1]
+                symbols[int(addr, 16) & 0xffff] = fields[1]
+
+
+def name(entry):
+    # Routine name for report
+    if entry is None:
+        return 'root'
+    return symbols.get(entry, cpu.dec2hex16(entry))
+
+
+def report(top=20):
+    # Opcodes and addresses sorted by ticks spent, as text
+    total = sum(op_ticks) or 1
+    lines = ['Opcodes by ticks (%d instructions, %d ticks)' % (sum(op_count), sum(op_ticks)),
+             ' op       count        ticks      %']
+    for op in sorted(range(256), key=lambda i: op_ticks[i], reverse=True)[:top]:
+        if op_count[op]:
+            lines.append(' %s %11d %12d %6.2f' % (cpu.dec2hex8(op), op_count[op], op_ticks[op],
+                                                  op_ticks[op] * 100 / total))
+    lines += ['', 'Addresses by ticks', ' addr  op       count        ticks      %']
+    ticks = np.frombuffer(pc_ticks, np.uint64)
+    for addr in np.argsort(ticks, kind='stable')[::-1][:top]:
+        addr = int(addr)
+        if pc_count[addr]:
+            lines.append(' %s %s %11d %12d %6.2f' % (cpu.dec2hex16(addr), cpu.dec2hex8(cpu.memory[addr]),
+                                                     pc_count[addr], pc_ticks[addr], pc_ticks[addr] * 100 / total))
+    return '\n'.join(lines)
+
+
+def call_report(top=20):
+    # Subroutines sorted by inclusive ticks, as text. Routines still running
+    # count up to now.
+    account()
+    total = clock or 1
+    incl = dict(inclusive)
+    running = set()
+    for entry, ret, start, path in stack[1:]:
+        if entry not in running:
+            running.add(entry)
+            incl[entry] = incl.get(entry, 0) + clock - start
+    lines = ['Subroutines by inclusive ticks (%d ticks)' % clock,
+             ' routine              calls    inclusive      %    exclusive      %']
+    for entry in sorted(incl, key=incl.get, reverse=True)[:top]:
+        lines.append(' %-16s %9d %12d %6.2f %12d %6.2f' % (name(entry), calls.get(entry, 0), incl[entry],
+                                                           incl[entry] * 100 / total, exclusive.get(entry, 0),
+                                                           exclusive.get(entry, 0) * 100 / total))
+    return '\n'.join(lines)
+
+
+def folded_stacks():
+    # Exclusive ticks of every call path in folded format of flamegraph.pl
+    # and speedscope: "root;caller;callee ticks" per line
+    account()
+    return '\n'.join('%s %d' % (';'.join(name(entry) for entry in path), ticks)
+                     for path, ticks in sorted(folded.items()) if ticks)
+
+
+def dump(filename, top=50):
+    # Write report to text file, call graph ones as well when it is traced
+    with open(filename, 'w') as f:
+        f.write(report(top) + '\n')
+        if call_graph:
+            f.write('\n' + call_report(top) + '\n')
+            with open(filename.rsplit('.', 1)[0] + '.folded', 'w') as g:
+                g.write(folded_stacks() + '\n')
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Instruction trace (part of Intel 8080 CPU emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# start() puts recording wrappers into cpu.dispatch (like i8080_prof), each
+# instruction packs one 24 byte record into a preallocated ring buffer,
+# bytearray or memory mapped file. Records keep state before the
+# instruction: PC, opcode, two following bytes, A, F, BC, DE, HL, SP and
+# ticks since trace start.
+#
+# Header goes in at start with no records written, stop() and save() put
+# their count in. A trace file left by a crash still has it 0, then
+# load() finds the oldest record from the ring itself: F always has bit 1
+# set in records and ticks grow.
+#
+#   python i8080_trace.py trace.bin [--from C000] [--to C7FF] [--tail N]
+#
+# decodes trace file oldest record first and disassembles it.
+
+import argparse
+import mmap
+import struct
+
+import numpy as np
+
+import i8080 as cpu
+
+MAGIC = b'I80T'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQ')  # Magic, version, record size, capacity, records written
+RECORD = struct.Struct('<HBBBBBxHHHHQ')  # PC, opcode, bytes 2 and 3, A, F, BC, DE, HL, SP, ticks
+RECORD_DTYPE = np.dtype([('pc', '<u2'), ('op', 'u1'), ('b2', 'u1'), ('b3', 'u1'), ('a', 'u1'), ('f', 'u1'),
+                         ('pad', 'u1'), ('bc', '<u2'), ('de', '<u2'), ('hl', '<u2'), ('sp', '<u2'),
+                         ('ticks', '<u8')])
+
+buffer = None  # Header and records
+capacity = 0  # Records in ring
+written = 0  # Records written since start
+clock = 0  # Ticks since start
+original = None  # Dispatch table replaced while tracing
+trace_file = None
+
+# Mnemonics, {n} is byte and {nn} is word operand
+regs = ['B', 'C', 'D', 'E', 'H', 'L', 'M', 'A']
+pairs = ['B', 'D', 'H', 'SP']
+conds = ['NZ', 'Z', 'NC', 'C', 'PO', 'PE', 'P', 'M']
+mnemonics = []
+for op in range(256):
+    y, z, p, q = (op >> 3) & 7, op & 7, (op >> 4) & 3, (op >> 3) & 1
+    if op < 0x40:
+        mnemonics.append([
+            'NOP',
+            ('LXI %s,{nn}' % pairs[p], 'DAD %s' % pairs[p])[q],
+            ['STAX B', 'LDAX B', 'STAX D', 'LDAX D', 'SHLD {nn}', 'LHLD {nn}', 'STA {nn}', 'LDA {nn}'][y],
+            ('INX %s' % pairs[p], 'DCX %s' % pairs[p])[q],
+            'INR %s' % regs[y],
+            'DCR %s' % regs[y],
+            'MVI %s,{n}' % regs[y],
+            ['RLC', 'RRC', 'RAL', 'RAR', 'DAA', 'CMA', 'STC', 'CMC'][y]][z])
+    elif op < 0x80:
+        mnemonics.append('HLT' if op == 0x76 else 'MOV %s,%s' % (regs[y], regs[z]))
+    elif op < 0xc0:
+        mnemonics.append('%s %s' % (['ADD', 'ADC', 'SUB', 'SBB', 'ANA', 'XRA', 'ORA', 'CMP'][y], regs[z]))
+    else:
+        mnemonics.append([
+            'R%s' % conds[y],
+            ('POP %s' % ['B', 'D', 'H', 'PSW'][p], ['RET', 'RET', 'PCHL', 'SPHL'][p])[q],
+            'J%s {nn}' % conds[y],
+            ['JMP {nn}', 'JMP {nn}', 'OUT {n}', 'IN {n}', 'XTHL', 'XCHG', 'DI', 'EI'][y],
+            'C%s {nn}' % conds[y],
+            ('PUSH %s' % ['B', 'D', 'H', 'PSW'][p], 'CALL {nn}')[q],
+            '%s {n}' % ['ADI', 'ACI', 'SUI', 'SBI', 'ANI', 'XRI', 'ORI', 'CPI'][y],
+            'RST %d' % y][z])
+
+
+def disassemble(op, b2, b3):
+    # Instruction text and length
+    text = mnemonics[op]
+    if '{nn}' in text:
+        return text.format(nn='%04X' % (b3 * 256 + b2)), 3
+    if '{n}' in text:
+        return text.format(n='%02X' % b2), 2
+    return text, 1
+
+
+def wrap(op, table):
+    # Handler of opcode op recording state before table[op]
+    pack = RECORD.pack_into
+    mem = cpu.memory
+    reg_a, reg_f, reg_bc, reg_de, reg_hl = cpu.reg_a, cpu.reg_f, cpu.reg_bc, cpu.reg_de, cpu.reg_hl
+
+    def traced():
+        global written, clock
+        pc = cpu.pc
+        cpu.flags2f()
+        pack(buffer, HEADER.size + (written % capacity) * RECORD.size, pc, op, mem[(pc + 1) & 0xffff],
+             mem[(pc + 2) & 0xffff], reg_a[0], reg_f[0], reg_bc[0], reg_de[0], reg_hl[0], cpu.sp, clock)
+        written += 1
+        start = cpu.ticks
+        table[op]()
+        clock += cpu.ticks - start
+    return traced
+
+
+def start(records=1 << 20, filename=None):
+    # Begin tracing into ring of records, memory mapped file if filename
+    # is given. Translated blocks of i8080_blocks are not traced, use cpu.run().
+    global buffer, capacity, written, clock, original, trace_file
+    size = HEADER.size + records * RECORD.size
+    if filename:
+        trace_file = open(filename, 'w+b')
+        trace_file.truncate(size)
+        buffer = mmap.mmap(trace_file.fileno(), size)
+    else:
+        buffer = bytearray(size)
+    capacity = records
+    written = clock = 0
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, RECORD.size, capacity, written)
+    original = cpu.dispatch
+    cpu.dispatch = [wrap(op, original) for op in range(256)]
+
+
+def stop():
+    # End tracing, memory mapped file gets records count after it
+    global original, trace_file
+    if original is not None:
+        cpu.dispatch = original
+        original = None
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, RECORD.size, capacity, written)
+    if trace_file:
+        buffer.flush()
+        buffer.close()
+        trace_file.close()
+        trace_file = None
+
+
+def save(filename):
+    # Write trace kept in memory to file
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, RECORD.size, capacity, written)
+    with open(filename, 'wb') as f:
+        f.write(buffer)
+
+
+def load(filename):
+    # Records of trace file as NumPy array, oldest first
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, version, size, records, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        raise ValueError('%s is not a version %d trace file' % (filename, VERSION))
+    ring = np.frombuffer(data, RECORD_DTYPE, records, HEADER.size)
+    if not count:  # Not stopped, written records are not zero
+        used = np.count_nonzero(ring['f'])
+        if used < records:
+            return ring[:used]
+        return np.roll(ring, -(int(np.argmax(ring['ticks'])) + 1))
+    if count <= records:
+        return ring[:count]
+    return np.roll(ring, -(count % records))
+
+
+def format_record(record):
+    # One trace line
+    code = [int(record['op']), int(record['b2']), int(record['b3'])]
+    text, size = disassemble(*code)
+    code = ' '.join('%02X' % b for b in code[:size])
+    return '%04X  %-9s %-13s A=%02X F=%02X BC=%04X DE=%04X HL=%04X SP=%04X T=%d' % (
+        record['pc'], code, text, record['a'], record['f'], record['bc'], record['de'], record['hl'],
+        record['sp'], record['ticks'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode 8080 trace file')
+    parser.add_argument('filename')
+    parser.add_argument('--from', dest='first', type=lambda s: int(s, 16), default=0, help='lowest PC, hex')
+    parser.add_argument('--to', dest='last', type=lambda s: int(s, 16), default=0xffff, help='highest PC, hex')
+    parser.add_argument('--tail', type=int, help='only last N matching records')
+    args = parser.parse_args()
+    records = load(args.filename)
+    records = records[(records['pc'] >= args.first) & (records['pc'] <= args.last)]
+    if args.tail:
+        records = records[-args.tail:]
+    for record in records:
+        print(format_record(record))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark suite (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Headless and reproducible: every workload starts from cleared memory and
+# registers and runs whole 40000 ticks frames, like the main loop does.
+#
+#   python spyc_bench.py                          all workloads, default engine
+#   python spyc_bench.py --engine core            original one instruction loop
+#   python spyc_bench.py --output new.json --baseline old.json
+#   python spyc_bench.py --loops --check          lockstep check, no timing
+#
+# Emulated MHz is the speed relative to the real 2 MHz CPU, instructions/sec
+# counts emulated 8080 instructions per host second, ms/frame is host time of
+# one 1/50 s frame (CPU only unless --render is given).
+#
+# Lockstep check runs every workload with the selected engine, then again
+# with reference handlers of cpu.opcodes and eager flags, instruction by
+# instruction up to the same tick of every frame. Ticks, PC, registers,
+# flags and RAM have to be equal at every frame end.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import zlib
+
+import pygame
+
+import i8080 as cpu
+import spyc_loader
+import spyc_keyboard
+import spyc_screen
+import spyc_video
+
+ROM = 'system.rom'
+GAME = 'zoo.rks'
+FRAME_TICKS = 40000  # 2 MHz / 50 Hz, as int_ticks in spycialist.py
+BOOT_FRAMES = 3  # ROM polls keyboard for the first time after 118474 ticks
+BOOT_RUNS = 10  # Boots per measurement, boot alone is too short to time
+MICRO_FRAMES = 50  # One emulated second per opcode group
+ZOO_FRAMES = 500
+ZOO_KEYS = [282, 13, 117, 13, 32, 32, 100, 100, 97, 97, 275, 275, 276, 276, 273, 274]  # F1, ENTER, U, ENTER, moves
+
+instructions = 0  # Counted by count_run()
+
+# Opcode group loops and fill and copy loops, each is put at 0x0100 and ends with JMP 0x0100
+MICRO = {
+    'mov': [0x41, 0x4a, 0x53, 0x5c, 0x65, 0x6f, 0x78,  # MOV B,C ... MOV A,B
+            0x06, 0x12, 0x0e, 0x34, 0x79, 0x47,  # MVI B,12h; MVI C,34h; MOV A,C; MOV B,A
+            0x01, 0x34, 0x12, 0x11, 0x78, 0x56, 0xeb,  # LXI B,1234h; LXI D,5678h; XCHG
+            0x41, 0x4a, 0x53, 0x5c, 0x65, 0x6f, 0x78],
+    'alu': [0x80, 0x89, 0x92, 0x9b, 0xa4, 0xad, 0xb7, 0xb8,  # ADD B ... CMP B
+            0x0c, 0x15, 0xc6, 0x05, 0xd6, 0x03,  # INR C; DCR D; ADI 5; SUI 3
+            0xe6, 0x7f, 0xee, 0x55, 0xf6, 0x01, 0xfe, 0x10,  # ANI 7Fh; XRI 55h; ORI 1; CPI 10h
+            0x27, 0x07, 0x1f, 0x2f, 0x3f, 0x37,  # DAA; RLC; RAR; CMA; CMC; STC
+            0x09, 0x03, 0x1b],  # DAD B; INX B; DCX D
+    'branch': [0x3c,  # 0100 INR A
+               0xca, 0x07, 0x01,  # 0101 JZ 0107h
+               0xc2, 0x07, 0x01,  # 0104 JNZ 0107h
+               0xcd, 0x14, 0x01,  # 0107 CALL 0114h
+               0xcf,  # 010A RST 1 (RET at 0008h)
+               0x21, 0x11, 0x01,  # 010B LXI H,0111h
+               0xe9,  # 010E PCHL
+               0x00, 0x00,  # 010F never executed
+               0xc3, 0x00, 0x01,  # 0111 JMP 0100h
+               0xc0,  # 0114 RNZ
+               0xc9],  # 0115 RET
+    'stack': [0xc5, 0xd5, 0xe5, 0xf5, 0xf1, 0xe1, 0xd1, 0xc1,  # PUSH B, D, H, PSW; POP PSW, H, D, B
+              0xe3, 0xe3, 0x33, 0x3b,  # XTHL; XTHL; INX SP; DCX SP
+              0xc5, 0xd5, 0xe5, 0xf5, 0xf1, 0xe1, 0xd1, 0xc1],
+    'memory': [0x21, 0x00, 0x40, 0x11, 0x00, 0x41,  # LXI H,4000h; LXI D,4100h
+               0x77, 0x46, 0x23, 0x70, 0x12, 0x1a,  # MOV M,A; MOV B,M; INX H; MOV M,B; STAX D; LDAX D
+               0x32, 0x00, 0x42, 0x3a, 0x00, 0x42,  # STA 4200h; LDA 4200h
+               0x22, 0x10, 0x42, 0x2a, 0x10, 0x42,  # SHLD 4210h; LHLD 4210h
+               0x36, 0x55, 0x34, 0x35, 0x86],  # MVI M,55h; INR M; DCR M; ADD M
+    'fill': [0x3c, 0x21, 0x00, 0x40, 0x0e, 0x00,  # 0100 INR A; LXI H,4000h; MVI C,0
+             0x77, 0x23, 0x0d, 0xc2, 0x06, 0x01,  # 0106 MOV M,A; INX H; DCR C; JNZ 0106h
+             0x11, 0x00, 0x40, 0x21, 0x00, 0x50, 0x01, 0x00, 0x04,  # LXI D,4000h; LXI H,5000h; LXI B,0400h
+             0x1a, 0x77, 0x23, 0x13,  # 0115 LDAX D; MOV M,A; INX H; INX D
+             0x0b, 0x78, 0xb1, 0xc2, 0x15, 0x01,  # DCX B; MOV A,B; ORA C; JNZ 0115h
+             0x3a, 0xff, 0x50],  # LDA 50FFh
+}
+
+WORKLOADS = list(MICRO) + ['boot', 'zoo']
+
+
+def reset():
+    # Power on state: cleared memory, registers and keyboard, ROM loaded
+    cpu.memory[:0xc000] = bytes(0xc000)
+    spyc_loader.rom(ROM, 0xc000)
+    cpu.regfile[:] = bytes(len(cpu.regfile))
+    cpu.f2flags()
+    cpu.pc = 0xc000
+    cpu.sp = 0x7fff
+    cpu.ticks = 0
+    for row in spyc_keyboard.kb_matrix[:7]:
+        row[:] = [0, 0]
+    spyc_keyboard.kb_matrix[7] = 0
+    spyc_keyboard.kb_mem[:] = bytes(3)
+    spyc_keyboard.vv55a_mode = 0x82
+    spyc_keyboard.update_ports()
+    spyc_video.invalidate()
+    if 'i8080_blocks' in sys.modules:
+        sys.modules['i8080_blocks'].flush()
+
+
+def setup(workload):
+    # Reset and prepare workload, return number of frames and key handler
+    reset()
+    if workload in MICRO:
+        code = MICRO[workload] + [0xc3, 0x00, 0x01]  # JMP 0100h
+        cpu.memory[0x0100:0x0100 + len(code)] = bytes(code)
+        cpu.memory[0x0008] = 0xc9  # RET for RST 1
+        cpu.pc = 0x0100
+        return MICRO_FRAMES, None
+    if workload == 'boot':
+        return BOOT_FRAMES * BOOT_RUNS, boot_frame
+    spyc_loader.game(GAME)
+    return ZOO_FRAMES, zoo_frame
+
+
+def boot_frame(frame):
+    # Restart boot every BOOT_FRAMES frames
+    if frame and not frame % BOOT_FRAMES:
+        reset()
+
+
+def zoo_frame(frame):
+    # Start the game and move around, key held for 5 frames every 20 frames
+    key = frame // 20
+    if key < len(ZOO_KEYS):
+        if frame % 20 == 0:
+            spyc_keyboard.keydown(ZOO_KEYS[key])
+        elif frame % 20 == 5:
+            spyc_keyboard.keyup(ZOO_KEYS[key])
+
+
+def core_run(budget):
+    # Original main loop of one instruction per call
+    start = cpu.ticks
+    end = start + budget
+    while cpu.ticks < end:
+        cpu.core()
+    return cpu.ticks - start
+
+
+def count_run(budget):
+    # core_run() counting instructions
+    global instructions
+    start = cpu.ticks
+    end = start + budget
+    while cpu.ticks < end:
+        cpu.core()
+        instructions += 1
+    return cpu.ticks - start
+
+
+def select_engine(name, lazy=False, alu=False):
+    # Import and set up engine, return its run(budget) function. Importing
+    # i8080_gen replaces reference handlers of cpu.run(), so 'run' engine
+    # has to be measured in its own process.
+    if name == 'core':
+        run = core_run
+    elif name == 'run':
+        run = cpu.run
+    elif name == 'gen':
+        import i8080_gen
+        run = cpu.run
+    else:
+        import i8080_blocks
+        run = i8080_blocks.run
+    set_lazy_flags(lazy)
+    if alu:
+        import i8080_alu
+        i8080_alu.set_alu_tables(True)
+    return run
+
+
+def set_lazy_flags(on):
+    # Flags mode of reference and, if imported, specialised handlers
+    if 'i8080_gen' in sys.modules:
+        sys.modules['i8080_gen'].set_lazy_flags(on)
+    else:
+        cpu.set_lazy_flags(on)
+
+
+def play(workload, run, screen=None):
+    # Run workload from the start, return ticks and host seconds
+    frames, on_frame = setup(workload)
+    ticks = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        if on_frame:
+            on_frame(frame)
+        run(FRAME_TICKS - cpu.ticks)
+        cpu.ticks -= FRAME_TICKS
+        ticks += FRAME_TICKS
+        if screen:
+            spyc_screen.render(screen)
+    seconds = time.perf_counter() - start
+    return frames, ticks + cpu.ticks, seconds
+
+
+def machine_state():
+    # CRC of RAM, registers, flags and SP with PC and ticks of this frame
+    cpu.flags2f()
+    return cpu.ticks, cpu.pc, zlib.crc32(bytes(cpu.regfile) + cpu.sp.to_bytes(2, 'little'), zlib.crc32(cpu.memory[:0xc000]))
+
+
+def reference_step():
+    # One instruction of reference handlers, i8080_gen replaces cpu.dispatch
+    cpu.opcode = cpu.memory[cpu.pc]
+    cpu.opcodes[cpu.opcode]()
+
+
+def check(workload, run, lazy):
+    # Lockstep check of engine against reference handlers, return number of
+    # the first frame ending in a different state or None
+    frames, on_frame = setup(workload)
+    states = []
+    for frame in range(frames):
+        if on_frame:
+            on_frame(frame)
+        run(FRAME_TICKS - cpu.ticks)
+        cpu.ticks -= FRAME_TICKS
+        states.append(machine_state())
+    set_lazy_flags(False)
+    setup(workload)
+    mismatch = None
+    for frame in range(frames):
+        if on_frame:
+            on_frame(frame)
+        end = FRAME_TICKS + states[frame][0]
+        while cpu.ticks < end:
+            reference_step()
+        cpu.ticks -= FRAME_TICKS
+        if machine_state() != states[frame]:
+            mismatch = frame
+            break
+    set_lazy_flags(lazy)
+    return mismatch
+
+
+def measure(workload, run, repeat=3, screen=None):
+    # Best of repeat runs and instruction count of one reference run
+    global instructions
+    frames, ticks, seconds = min((play(workload, run, screen) for _ in range(repeat)), key=lambda r: r[2])
+    instructions = 0
+    play(workload, count_run)
+    return {'frames': frames,
+            'ticks': ticks,
+            'instructions': instructions,
+            'seconds': round(seconds, 4),
+            'mhz': round(ticks / seconds / 1e6, 3),
+            'ips': round(instructions / seconds),
+            'ms_per_frame': round(seconds / frames * 1000, 3)}
+
+
+def compare(results, baseline):
+    # Print emulated MHz of both result sets for common workloads
+    print()
+    print('%-8s %10s %10s %8s' % ('', 'MHz', 'baseline', 'change'))
+    for name, result in results['workloads'].items():
+        if name in baseline['workloads']:
+            base = baseline['workloads'][name]['mhz']
+            print('%-8s %10.3f %10.3f %+7.1f%%' % (name, result['mhz'], base, (result['mhz'] / base - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sPycialist benchmark suite')
+    parser.add_argument('--engine', choices=('core', 'run', 'gen', 'blocks'), default='blocks')
+    parser.add_argument('--eager', action='store_true', help='eager flags instead of lazy ones')
+    parser.add_argument('--alu', action='store_true', help='precomputed ALU tables')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help='comma separated list')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--hle', action='store_true', help='ROM routines traps, blocks engine only')
+    parser.add_argument('--loops', action='store_true', help='skip delay and polling loops, fill and copy in bulk, blocks engine only')
+    parser.add_argument('--render', action='store_true', help='render screen every frame')
+    parser.add_argument('--check', action='store_true', help='lockstep check against reference handlers, no timing')
+    parser.add_argument('--output', help='write results to JSON file')
+    parser.add_argument('--baseline', help='compare with results JSON file')
+    args = parser.parse_args()
+
+    screen = None
+    if args.render:
+        screen = pygame.Surface(spyc_screen.init())
+    run = select_engine(args.engine, not args.eager, args.alu)
+    if args.hle:
+        import spyc_hle
+        spyc_loader.rom(ROM, 0xc000)
+        spyc_hle.install()
+    if args.loops:
+        import i8080_loops
+        i8080_loops.set_loop_skipping(True)
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'engine': args.engine,
+               'lazy_flags': not args.eager,
+               'alu_tables': args.alu,
+               'hle': args.hle,
+               'loops': args.loops,
+               'render': args.render,
+               'workloads': {}}
+    if args.check:
+        for name in args.workloads.split(','):
+            frame = check(name, run, not args.eager)
+            print('%-8s %s' % (name, 'OK' if frame is None else 'mismatch at frame %d' % frame))
+        return
+    print('%-8s %7s %12s %12s %8s %9s' % ('', 'frames', 'instructions', 'instr/s', 'MHz', 'ms/frame'))
+    for name in args.workloads.split(','):
+        result = measure(name, run, args.repeat, screen)
+        results['workloads'][name] = result
+        print('%-8s %7d %12d %12d %8.3f %9.3f' % (name, result['frames'], result['instructions'], result['ips'],
+                                                   result['mhz'], result['ms_per_frame']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ROM routines traps (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# High level emulation of the hottest Specialist ROM routines. install() puts
+# native versions into i8080_blocks.traps, so they run in place of the block
+# at routine entry and leave memory, registers, stack leftovers and ticks as
+# the 8080 code does. A trap returns False for cases it does not cover and
+# the ROM code runs instead. Interpreter engines (cpu.run, profiling,
+# tracing) always run the ROM code.
+#
+#   python spyc_hle.py
+#
+# compares every trap with the interpreted routine on random machine states.
+
+import random
+import zlib
+
+import i8080 as cpu
+import i8080_blocks
+import i8080_gen
+import spyc_keyboard
+import spyc_loader
+import spyc_tape
+import spyc_video
+
+ROM = 'system.rom'
+
+# System variables
+FONT = 0x8fe7  # Font address, character 20h is at (FONT) * 8
+LOAD_START = 0x8fe3  # Start address of the last block loaded from tape
+CHAR = 0x8fe9  # Character being printed
+SAVED_SP = 0x8ff6
+CHAR_ADDR = 0x8ff8  # Video address of the last printed character
+COLOR = 0x8ffa  # Clear screen fill word, also mode of character 7Fh
+CURSOR = 0x8ffc  # Cursor Y (pixel row) and X (2 pixels units)
+TAPE_INVERTED = 0x8ff3  # 0 or FFh, set by sync byte
+READ_DELAY = 0x8fff  # Tape bit reading delay, 3Ch after reset
+
+CLEAR_TICKS = 94 + 0x300 * 113 + 51  # Before, per loop and after the fill loop
+BYTE_TICKS = 0  # Tape bytes come at once, only the code around tape reads takes time
+LOAD_TICKS = (142, 83, 13)  # Block loading without tape reads: fixed, per byte, per byte of the last page
+INVERT = bytes(range(255, -1, -1))
+
+
+def pop_return():
+    # RET at the end of a trapped routine
+    cpu.pc = cpu.read_mem(cpu.sp) + cpu.read_mem((cpu.sp + 1) & 0xffff) * 256
+    cpu.sp = (cpu.sp + 2) & 0xffff
+
+
+def push_leftovers(data):
+    # Bytes routine leaves below the stack pointer, data[0] goes to SP - 1
+    for i, byte in enumerate(data):
+        cpu.write_mem((cpu.sp - 1 - i) & 0xffff, byte)
+
+
+def clear_screen():
+    # C010: fill video RAM with word at COLOR by PUSH loop, A = 0
+    push_leftovers((cpu.reg_h[0], cpu.reg_l[0], cpu.reg_b[0], cpu.reg_c[0]))
+    saved = (cpu.sp - 4) & 0xffff
+    cpu.write_mem(SAVED_SP, saved & 0xff)
+    cpu.write_mem(SAVED_SP + 1, saved >> 8)
+    cpu.memory[0x9000:0xc000] = bytes((cpu.read_mem(COLOR), cpu.read_mem(COLOR + 1))) * 0x1800
+    # Video RAM was changed bypassing write_mem()
+    for page in range(0x90, 0xc0):
+        i8080_blocks.flush_page(page)
+    spyc_video.invalidate()
+    cpu.reg_a[0] = 0
+    cpu.or_a(0)
+    cpu.ticks += CLEAR_TICKS
+    pop_return()
+    return True
+
+
+def put_char():
+    # C037: draw character C at cursor and move cursor right. Control
+    # characters and the end of line (screen clear or scroll wait) are left
+    # to the ROM.
+    char = cpu.reg_c[0]
+    y, x = cpu.read_mem(CURSOR), cpu.read_mem(CURSOR + 1)
+    if char < 0x21 or x >= 0xbe:
+        return False
+    cpu.flags2f()
+    push_leftovers((cpu.reg_h[0], cpu.reg_l[0], cpu.reg_d[0], cpu.reg_e[0],
+                    cpu.reg_b[0], cpu.reg_c[0], cpu.reg_a[0], cpu.reg_f[0]) + (0xc0, 0x97) * 8)
+    cpu.write_mem(CURSOR + 1, x + 3)
+    cpu.write_mem(CHAR, char)
+    font = cpu.read_mem(FONT) + cpu.read_mem(FONT + 1) * 256
+    glyph = ((font & 0xff00 | (font + char - 0x20) & 0xff) * 8) & 0xffff
+    shift = 2 * (5 - (x & 3))
+    col = 0x90 + (x >> 2)
+    cpu.write_mem(CHAR_ADDR, y)
+    cpu.write_mem(CHAR_ADDR + 1, col)
+    rows = [cpu.read_mem((glyph + row) & 0xffff) for row in range(8)]
+    if char == 0x7f:
+        mode = cpu.read_mem(COLOR)
+        per_byte = 98 if not mode else 93
+    else:
+        per_byte = 57
+    for row in range(7, -1, -1):
+        bits = (rows[row] << shift) & 0xffff
+        addr = col << 8 | (y - 7 + row) & 0xff
+        for byte in (bits >> 8, bits & 0xff):
+            if char != 0x7f:
+                byte ^= cpu.read_mem(addr)
+            elif mode:
+                byte |= cpu.read_mem(addr)
+            else:
+                byte = ~byte & cpu.read_mem(addr)
+            cpu.write_mem(addr, byte)
+            addr += 0x100
+    cpu.ticks += 1607 + 140 * shift + 16 * per_byte
+    pop_return()
+    return True
+
+
+def tape_byte():
+    # C377: byte from spyc_tape, A = 80h-FFh searches sync byte first,
+    # A = 8 reads next byte. End of tape is left to the ROM, it waits for
+    # tape signal then.
+    mode = cpu.reg_a[0]
+    if mode != 8 and mode < 0x80:
+        return False
+    saved = spyc_tape.position
+    inverted = spyc_tape.sync() if mode >= 0x80 else cpu.read_mem(TAPE_INVERTED)
+    byte = spyc_tape.read(1) if inverted is not None else None
+    if byte is None:
+        spyc_tape.position = saved
+        return False
+    push_leftovers((cpu.reg_b[0], cpu.reg_c[0], cpu.reg_d[0], cpu.reg_e[0], 0xc3, 0x9a))
+    if mode >= 0x80:
+        cpu.write_mem(TAPE_INVERTED, inverted)
+    cpu.reg_a[0] = inverted
+    cpu.xor_a(byte[0])
+    cpu.ticks += BYTE_TICKS
+    pop_return()
+    return True
+
+
+def tape_load():
+    # C3F9: sync, start and end address and block of data from spyc_tape
+    # copied into memory at once. Blocks running over ROM, stack or tape
+    # variables are loaded byte by byte.
+    saved = spyc_tape.position
+    inverted = spyc_tape.sync()
+    head = spyc_tape.read(4) if inverted is not None else None
+    if head is None:
+        spyc_tape.position = saved
+        return False
+    if inverted:
+        head = head.translate(INVERT)
+    start, end = head[0] | head[1] << 8, head[2] | head[3] << 8
+    sp = cpu.sp
+    data = spyc_tape.read(end - start + 1) if start <= end < 0xc000 else None
+    if data is None or start <= TAPE_INVERTED <= end or (start < sp and end >= sp - 8) or sp < 8:
+        spyc_tape.position = saved
+        return False
+    if inverted:
+        data = data.translate(INVERT)
+    push_leftovers((0xc4, 0x1d, cpu.reg_b[0], cpu.reg_c[0], end >> 8, end & 0xff, 0xc3, 0x9a))
+    cpu.write_mem(TAPE_INVERTED, inverted)
+    cpu.write_mem(LOAD_START, start & 0xff)
+    cpu.write_mem(LOAD_START + 1, start >> 8)
+    cpu.memory[start:end + 1] = data
+    # Memory was changed bypassing write_mem()
+    for page in range(start >> 8, (end >> 8) + 1):
+        i8080_blocks.flush_page(page)
+    if end >= 0x9000:
+        spyc_video.invalidate()
+    cpu.reg_hl[0] = end + 1
+    cpu.reg_de[0] = end
+    cpu.reg_a[0] = end & 0xff
+    cpu.cp_a(end & 0xff)
+    fixed, per_byte, last_page = LOAD_TICKS
+    cpu.ticks += fixed + per_byte * len(data) + last_page * (end - max(start, end & 0xff00) + 1) + \
+        (len(data) + 4) * BYTE_TICKS
+    pop_return()
+    return True
+
+
+# Entry address -> trap, end of routine code and its CRC32 in system.rom
+TRAPS = {
+    0xc010: (clear_screen, 0xc037, 0x1a1af15f),
+    0xc037: (put_char, 0xc0b2, 0xdfa7efb0),
+    0xc377: (tape_byte, 0xc3d0, 0x663ddc38),
+    0xc3f9: (tape_load, 0xc42d, 0xb5cb4c23),
+}
+
+# Entry address -> traps used by its interpreted routine in verify() and
+# whether it reads tape signal of spyc_tape image instead of the image itself
+REFERENCE = {
+    0xc010: ({}, False),
+    0xc037: ({}, False),
+    0xc377: ({}, True),
+    0xc3f9: ({0xc377: tape_byte}, False),
+}
+
+
+def install():
+    # Put traps of routines found unchanged in memory, return their number
+    count = 0
+    for entry, (trap, end, crc) in TRAPS.items():
+        if zlib.crc32(cpu.memory[entry:end]) == crc:
+            i8080_blocks.traps[entry] = trap
+            count += 1
+    i8080_blocks.flush()
+    return count
+
+
+def remove():
+    i8080_blocks.traps.clear()
+    i8080_blocks.flush()
+
+
+def random_state(entry):
+    # Machine state for a call of routine at entry: stack below the system
+    # variables, return address into RAM
+    cpu.memory[:0xc000] = random.randbytes(0xc000)
+    cpu.regfile[:] = random.randbytes(8)
+    cpu.flag_c, cpu.flag_p, cpu.flag_h, cpu.flag_z, cpu.flag_s = (random.random() < 0.5 for _ in range(5))
+    cpu.sp = random.randrange(0x7000, 0x8f00)
+    cpu.memory[cpu.sp:cpu.sp + 2] = random.randrange(0xc000).to_bytes(2, 'little')
+    cpu.pc = entry
+    if entry == 0xc037:
+        # Font out of the stack, some 7Fh characters with both modes
+        cpu.memory[FONT + 1] = random.randrange(0x0e)
+        if random.random() < 0.2:
+            cpu.reg_c[0] = 0x7f
+            cpu.memory[COLOR] = random.choice((0, random.randrange(256)))
+    elif entry == 0xc3f9:
+        # Block below the stack on tape, normal or inverted
+        start = random.randrange(0x6000)
+        block = start.to_bytes(2, 'little') + (start + random.randrange(0x800)).to_bytes(2, 'little')
+        block += random.randbytes(block[2] + block[3] * 256 - start + 1)
+        inverted = random.choice((0, 0xff))
+        spyc_tape.attach(random.randbytes(random.randrange(8)) + bytes(16) + bytes((spyc_tape.SYNC ^ inverted,)) +
+                         bytes(b ^ inverted for b in block) + random.randbytes(random.randrange(8)))
+    elif entry == 0xc377:
+        # Sync search on tape played at reset speed
+        cpu.reg_a[0] = 0xff
+        cpu.memory[READ_DELAY] = 0x3c
+        spyc_keyboard.vv55a_mode = 0x82
+        spyc_keyboard.update_ports()
+        inverted = random.choice((0, 0xff))
+        spyc_tape.attach(bytes(2) + bytes((spyc_tape.SYNC ^ inverted,)) + random.randbytes(2))
+        spyc_tape.play(*spyc_tape.signal(spyc_tape.tape))
+
+
+def interpret(traps):
+    # Run routine by the interpreter until it returns, traps of routines it
+    # calls included
+    sp = cpu.sp
+    ret = cpu.read_mem(sp) + cpu.read_mem(sp + 1) * 256
+    while cpu.pc != ret or cpu.sp != sp + 2:
+        if not (cpu.pc in traps and traps[cpu.pc]()):
+            cpu.core()
+
+
+def outcome(signal):
+    # What trap has to reproduce: machine state and tape position, ticks of
+    # waiting for tape signal and image position are not comparable
+    state = i8080_gen.machine_state()
+    if signal:
+        return state[:4] + state[5:]
+    return state, spyc_tape.position
+
+
+def verify(rounds=100):
+    # Compare traps with interpreted ROM code, return entries of failed
+    # traps and of traps which did not handle any call
+    lazy = cpu.lazy_flags
+    saved = i8080_gen.machine_state()
+    failed = []
+    for entry, (traps, signal) in REFERENCE.items():
+        trap = TRAPS[entry][0]
+        handled = 0
+        for _ in range(rounds):
+            cpu.set_lazy_flags(False)
+            random_state(entry)
+            state = i8080_gen.machine_state()
+            position = spyc_tape.position
+            cpu.set_lazy_flags(random.random() < 0.5)
+            if not trap():
+                continue
+            handled += 1
+            result = outcome(signal)
+            i8080_gen.set_machine_state(state)
+            spyc_tape.position = position
+            spyc_tape.play_next = 0
+            cpu.set_lazy_flags(False)
+            interpret(traps)
+            if outcome(signal) != result:
+                break
+        else:
+            if handled:
+                continue
+        failed.append(entry)
+    spyc_tape.stop()
+    spyc_tape.attach(b'')
+    cpu.set_lazy_flags(False)
+    i8080_gen.set_machine_state(saved)
+    cpu.set_lazy_flags(lazy)
+    return failed
+
+
+if __name__ == '__main__':
+    spyc_loader.rom(ROM, 0xc000)
+    errors = verify()
+    print('ROM traps:', 'all match' if not errors else 'mismatch ' + ' '.join(cpu.dec2hex16(e) for e in errors))
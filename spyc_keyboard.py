@@ -5,6 +5,8 @@
 # (C) Stanislav Yudin (CityAceE)
 # http://zx-pk.ru
 
+import i8080 as cpu
+
 keys = {
   # Key  [   C O L U M N    ] [  R O W  ]
     282: [0b1000, 0b00000000, 0b10000000],  # F - F1
@@ -90,22 +92,28 @@ keys = {
 vv55a_mode = 0x82
 kb_mem = bytearray([0x00, 0x00, 0x00])
 kb_matrix = [[0, 0], [0, 0], [0, 0], [0, 0], [0, 0], [0, 0], [0, 0], 0]
+kb_ports = [None] * 4  # Values read from ports, recomputed on every change
+port_c_written = None  # Called with port C value when it is written, e.g. by spyc_sound
+
+rows = {2: 6, 4: 5, 8: 4, 16: 3, 32: 2, 64: 1, 128: 0}  # Row bit -> kb_matrix index
 
 
 def keydown(code):
     if code in keys:
-        i = {2: 6, 4: 5, 8: 4, 16: 3, 32: 2, 64: 1, 128: 0}[keys[code][2]]
+        i = rows[keys[code][2]]
         kb_matrix[i][0] |= keys[code][0]
         kb_matrix[i][1] |= keys[code][1]
         kb_matrix[7] |= keys[code][2]
+        update_ports()
 
 
 def keyup(code):
     if code in keys:
-        i = {2: 6, 4: 5, 8: 4, 16: 3, 32: 2, 64: 1, 128: 0}[keys[code][2]]
+        i = rows[keys[code][2]]
         kb_matrix[i][0] &= 0xff - keys[code][0]
         kb_matrix[i][1] &= 0xff - keys[code][1]
         kb_matrix[7] &= 0xff - keys[code][2]
+        update_ports()
 
 
 def get_port_91(mem, matrix):
@@ -128,28 +136,46 @@ def get_port_82(mem, matrix):
     return byte
 
 
-def read_kb_ports(addr):
+def get_port(port):
+    # Value of port 0-3 for current mode and matrix state
     if vv55a_mode == 0x91:
-        if not (addr % 4):
+        if not port:
             return get_port_91(1, 1)
-        elif addr % 4 == 1:
+        elif port == 1:
             return 0xff - kb_mem[1]
-        elif addr % 4 == 2:
+        elif port == 2:
             return get_port_91(1, 0) % 0x10
     elif vv55a_mode == 0x82:
-        if not (addr % 4):
+        if not port:
             return 0xff - kb_mem[0]
-        elif addr % 4 == 1:
+        elif port == 1:
             byte = get_port_82(0, 1)
             byte |= get_port_82(2, 0)
             return 0xff - byte - (kb_matrix[7] & 2)
-        elif addr % 4 == 2:
+        elif port == 2:
             return 0xff - kb_mem[2]
 
 
+def update_ports():
+    # Recompute port values after matrix, port or mode change
+    for port in range(4):
+        kb_ports[port] = get_port(port)
+
+
+def read_kb_ports(addr):
+    return kb_ports[addr % 4]
+
+
 def write_kb_ports(addr, byte):
     global vv55a_mode
+    if addr % 4 == 3 and not byte & 0x80:
+        # Bit set/reset of port C
+        mask = 1 << ((byte >> 1) & 7)
+        port_c = 0xff - kb_mem[2]
+        return write_kb_ports(2, port_c | mask if byte & 1 else port_c & ~mask)
     if addr % 4 != 3:
+        if kb_mem[(addr % 4)] == 0xff - byte:
+            return
         kb_mem[(addr % 4)] = 0xff - byte
     elif byte == 0x91:
         vv55a_mode = byte
@@ -158,3 +184,12 @@ def write_kb_ports(addr, byte):
         vv55a_mode = byte
         kb_mem[0] = 0xff
         kb_mem[2] = 0xff
+    update_ports()
+    if port_c_written and addr % 4 >= 2:
+        port_c_written(0xff - kb_mem[2])
+
+
+update_ports()
+
+# Specialist keyboard ports
+cpu.map_pages(0xf8, 0xff, read_kb_ports, write_kb_ports)
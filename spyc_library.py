@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Game library (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# RKS files in directories and zip archives are checked once and put into
+# index file with their addresses and hashes. Scanning again reads only
+# files and archives changed since then.
+#
+# RKS file: start and end address (little endian), end - start + 1 bytes
+# of data and checksum of data computed as Specialist ROM does it.
+
+import hashlib
+import json
+import os
+import zipfile
+
+import i8080 as cpu
+import i8080_blocks
+import spyc_video
+
+INDEX = 'library.json'
+INDEX_VERSION = 1
+
+sources = {}  # Path -> {'mtime', 'size'} of scanned file or archive
+games = {}  # Name -> {'path', 'member', 'start', 'end', 'size', 'sha1'}
+
+
+def checksum(data):
+    # Tape checksum: low byte sums all bytes, high byte all but the last
+    # one with carries from low byte
+    low = high = 0
+    for byte in data[:-1]:
+        low += byte
+        high = (high + byte + (low >> 8)) & 0xff
+        low &= 0xff
+    return high << 8 | (low + data[-1]) & 0xff
+
+
+def check(data):
+    # Start and end address of RKS file contents, ValueError if it is broken
+    if len(data) < 7:
+        raise ValueError('too short')
+    start = data[0] | data[1] << 8
+    end = data[2] | data[3] << 8
+    if end < start:
+        raise ValueError('end %04X before start %04X' % (end, start))
+    if end >= 0xc000:
+        raise ValueError('end %04X is in ROM' % end)
+    if len(data) < end - start + 7:
+        raise ValueError('%d bytes of %d' % (len(data), end - start + 7))
+    stored = data[end - start + 5] | data[end - start + 6] << 8
+    if checksum(data[4:end - start + 5]) != stored:
+        raise ValueError('wrong checksum')
+    return start, end
+
+
+def open_index(filename=INDEX):
+    # Read index file, nothing happens if there is none
+    if os.path.exists(filename):
+        with open(filename) as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION:
+            sources.update(index['sources'])
+            games.update(index['games'])
+
+
+def save_index(filename=INDEX):
+    with open(filename, 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'sources': sources, 'games': games}, f, indent=1, sort_keys=True)
+
+
+def add(path, member, data, problems):
+    # Check one RKS file and add it to games under a free name
+    where = path + (':' + member if member else '')
+    try:
+        start, end = check(data)
+    except ValueError as error:
+        problems.append('%s: %s' % (where, error))
+        return
+    name = stem = os.path.splitext(os.path.basename(member or path))[0].lower()
+    number = 1
+    while name in games:
+        number += 1
+        name = '%s_%d' % (stem, number)
+    games[name] = {'path': path, 'member': member, 'start': start, 'end': end, 'size': len(data),
+                   'sha1': hashlib.sha1(data).hexdigest()}
+
+
+def scan_file(path, problems):
+    # Add RKS file or RKS files of zip archive
+    if path.lower().endswith('.rks'):
+        with open(path, 'rb') as f:
+            add(path, None, f.read(), problems)
+        return
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith('.rks'):
+                    add(path, member, archive.read(member), problems)
+    except zipfile.BadZipFile:
+        problems.append('%s: bad zip archive' % path)
+
+
+def scan(paths, filename=INDEX):
+    # Bring index up to date with RKS files and zip archives in paths,
+    # return list of files which are not valid games
+    problems = []
+    found = {}
+    for top in paths:
+        for root, dirs, files in os.walk(top):
+            for name in files:
+                if name.lower().endswith(('.rks', '.zip')):
+                    path = os.path.normpath(os.path.join(root, name))
+                    stat = os.stat(path)
+                    found[path] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    for path in [path for path in sources if sources[path] != found.get(path)]:
+        del sources[path]
+        for name in [name for name in games if games[name]['path'] == path]:
+            del games[name]
+    for path in sorted(found):
+        if path not in sources:
+            scan_file(path, problems)
+            sources[path] = found[path]
+    save_index(filename)
+    return problems
+
+
+def find(name, paths=None):
+    # Library entry by game name or RKS file name, KeyError if there is none.
+    # Unknown name makes a scan of paths, if they are given.
+    name = os.path.splitext(os.path.basename(name))[0].lower()
+    if name not in games and paths:
+        scan(paths)
+    return games[name]
+
+
+def read(name):
+    # Contents of RKS file
+    game = find(name)
+    if game['member']:
+        with zipfile.ZipFile(game['path']) as archive:
+            return archive.read(game['member'])
+    with open(game['path'], 'rb') as f:
+        return f.read()
+
+
+def load(name):
+    # Put game into memory, return its start address
+    game = find(name)
+    data = memoryview(read(name))
+    if hashlib.sha1(data).hexdigest() != game['sha1']:
+        raise ValueError('%s was changed since indexing, scan library again' % name)
+    start, end = game['start'], game['end']
+    cpu.memory[start:end + 1] = data[4:end - start + 5]
+    # Memory was changed bypassing write_mem()
+    i8080_blocks.flush()
+    spyc_video.invalidate()
+    return start
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# CPU and display in separate processes (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# display() runs in the emulator process, starts this file as CPU process
+# and talks to it through one multiprocessing.shared_memory block:
+#
+#   control    32 bit words: video sequence, quit flag, key ring head and
+#              tail, emulated frames counter
+#   key ring   KEYS 64 bit entries, key code * 2 + 1 for press, + 0 for
+#              release. Display process only moves head, CPU process only
+#              moves tail, so no lock is needed.
+#   video RAM  0x9000-0xBFFF, written by CPU process under sequence counter:
+#              odd while copying, even when done
+#
+# CPU process handles Specialist keys only, savestates, rewind and turbo
+# hotkeys work in single process mode.
+
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import i8080 as cpu
+import spyc_video
+
+SEQ, QUIT, HEAD, TAIL, FRAMES = range(5)
+KEYS = 256
+KEY_RING = 32
+VIDEO = KEY_RING + 8 * KEYS
+SIZE = VIDEO + 0x3000
+FPS = 50
+
+
+def attach(name):
+    # Open shared memory made by display process, it is unlinked there
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # Python before 3.13
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def display(screen, rom, game, warm_boot, hle, loops, lazy):
+    # Emulator window: draw frames published by CPU process, send keys to it
+    import pygame
+    import spyc_screen
+
+    shm = shared_memory.SharedMemory(create=True, size=SIZE)
+    shm.buf[:SIZE] = bytes(SIZE)
+    control = shm.buf[:KEY_RING].cast('I')
+    keys = shm.buf[KEY_RING:VIDEO].cast('q')
+    video = np.frombuffer(shm.buf, np.uint8, 0x3000, VIDEO).reshape(spyc_video.COLUMNS, 256)
+    child = subprocess.Popen([sys.executable, __file__, shm.name, rom, game] + (['--warm'] if warm_boot else []) +
+                             (['--hle'] if hle else []) + (['--loops'] if loops else []) + (['--lazy'] if lazy else []))
+    clock = pygame.time.Clock()
+    caption = 'sPycialist'
+    shown = 0
+    frames = 0
+    start = time.perf_counter()
+    try:
+        while child.poll() is None:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    control[QUIT] = 1
+                elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                    head = control[HEAD]
+                    if (head - control[TAIL]) & 0xffffffff < KEYS:
+                        keys[head % KEYS] = event.key * 2 + (event.type == pygame.KEYDOWN)
+                        control[HEAD] = (head + 1) & 0xffffffff
+            seq = control[SEQ]
+            if seq != shown and not seq & 1:
+                frame = video.copy()
+                if control[SEQ] == seq:
+                    shown = seq
+                    for col in np.flatnonzero((frame != spyc_screen.vram).any(axis=1)):
+                        spyc_screen.vram[col] = frame[col]
+                        spyc_video.dirty[col] = 1
+                    if spyc_screen.render(screen):
+                        pygame.display.flip()
+            clock.tick(60)
+            if time.perf_counter() - start >= 1:
+                pygame.display.set_caption('{} - {:.2f} FPS - CPU process'.format(
+                    caption, (control[FRAMES] - frames) / (time.perf_counter() - start)))
+                frames = control[FRAMES]
+                start = time.perf_counter()
+    finally:
+        control[QUIT] = 1
+        child.wait()
+        del control, keys, video
+        shm.close()
+        shm.unlink()
+
+
+def cpu_main(name, rom, game, warm_boot, hle, loops, lazy):
+    # CPU process: run emulation at FPS frames per second, publish video RAM
+    import i8080_blocks
+    import i8080_loops
+    import spyc_hle
+    import spyc_keyboard
+    import spyc_library
+    import spyc_loader
+    import spyc_sched
+    import spyc_state
+
+    shm = attach(name)
+    control = shm.buf[:KEY_RING].cast('I')
+    keys = shm.buf[KEY_RING:VIDEO].cast('q')
+    video = shm.buf[VIDEO:SIZE]
+    int_ticks = 2000000 // FPS
+    i8080_blocks.set_lazy_flags(lazy)
+    i8080_loops.set_loop_skipping(loops)
+    spyc_library.open_index()  # Warm snapshot name needs the game entry too
+    if not (warm_boot and spyc_state.load_warm(rom, game)):
+        spyc_library.load(game)
+        spyc_loader.rom(rom, 0xc000)
+        cpu.pc = 0xc000
+        cpu.sp = 0x7FFF
+        if warm_boot:
+            spyc_state.save_warm(rom, game, i8080_blocks.run, int_ticks)
+    if hle:
+        spyc_hle.install()
+
+    def end_frame():
+        spyc_sched.rebase(int_ticks)
+        spyc_sched.stop()
+
+    spyc_sched.add(int_ticks, end_frame, int_ticks)
+    due = time.perf_counter()
+    while not control[QUIT]:
+        spyc_sched.run(i8080_blocks.run)
+        control[FRAMES] = (control[FRAMES] + 1) & 0xffffffff
+        while control[TAIL] != control[HEAD]:
+            tail = control[TAIL]
+            key = keys[tail % KEYS]
+            if key & 1:
+                spyc_keyboard.keydown(key >> 1)
+            else:
+                spyc_keyboard.keyup(key >> 1)
+            control[TAIL] = (tail + 1) & 0xffffffff
+        changed = spyc_video.changed_columns()
+        if changed:
+            control[SEQ] = (control[SEQ] + 1) & 0xffffffff
+            for col in changed:
+                video[col * 256:(col + 1) * 256] = cpu.memory[0x9000 + col * 256:0x9100 + col * 256]
+            control[SEQ] = (control[SEQ] + 1) & 0xffffffff
+        due += 1 / FPS
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -0.1:
+            due = time.perf_counter()  # Too late, don't try to catch up
+    del control, keys, video
+    shm.close()
+
+
+if __name__ == '__main__':
+    cpu_main(sys.argv[1], sys.argv[2], sys.argv[3], '--warm' in sys.argv, '--hle' in sys.argv,
+             '--loops' in sys.argv, '--lazy' in sys.argv)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Rewind buffer (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Every INTERVAL frames a checkpoint keeps machine state without memory
+# (spyc_state.pack_machine) and previous contents of the 256 byte pages
+# changed since the last checkpoint. Pages are found by comparing memory with
+# its shadow copy as 256 x 256 NumPy array. Stepping back restores the last
+# checkpoint, then undoes checkpoints one by one. ZOO changes a few pages per
+# checkpoint, so minutes of history take a few MB instead of 64 KB per frame.
+
+from collections import deque
+
+import numpy as np
+
+import i8080 as cpu
+import i8080_blocks
+import spyc_state
+import spyc_video
+
+INTERVAL = 10  # Frames between checkpoints, 5 checkpoints per second
+CAPACITY = 3000  # Checkpoints kept, 10 minutes
+MAX_BYTES = 16 * 1024 * 1024  # Memory pages kept, older checkpoints are dropped first
+
+pages = np.frombuffer(cpu.memory, np.uint8).reshape(256, 256)
+shadow = pages.copy()  # Memory at the last checkpoint
+checkpoints = deque()  # (machine state, changed pages, their previous contents)
+stored = 0  # Bytes of pages in checkpoints
+frames = 0  # Frames since the last checkpoint
+
+
+def reset():
+    # Forget history, e.g. after loading a state
+    global stored, frames
+    checkpoints.clear()
+    stored = frames = 0
+    shadow[:] = pages
+    checkpoints.append((spyc_state.pack_machine(), np.empty(0, np.intp), shadow[:0].copy()))
+
+
+def checkpoint():
+    # Record machine state and pages changed since the previous checkpoint
+    global stored
+    changed = np.flatnonzero((pages != shadow).any(axis=1))
+    old = shadow[changed]  # Fancy indexing makes a copy
+    shadow[changed] = pages[changed]
+    checkpoints.append((spyc_state.pack_machine(), changed, old))
+    stored += old.nbytes
+    while len(checkpoints) > CAPACITY or stored > MAX_BYTES and len(checkpoints) > 1:
+        stored -= checkpoints.popleft()[2].nbytes
+
+
+def frame():
+    # Call once per emulated frame
+    global frames
+    frames += 1
+    if frames >= INTERVAL:
+        frames = 0
+        checkpoint()
+
+
+def restore(changed):
+    # Put shadow into changed memory pages
+    pages[changed] = shadow[changed]
+    for page in changed:
+        i8080_blocks.flush_page(int(page))
+    cpu.code_dirty = False
+
+
+def step_back():
+    # Go to the last checkpoint, or to the one before when machine is at the
+    # last one already. False if there is no more history.
+    global stored, frames
+    changed = np.flatnonzero((pages != shadow).any(axis=1))
+    if not frames and not changed.size:
+        if len(checkpoints) < 2:
+            return False
+        state, changed, old = checkpoints.pop()
+        stored -= old.nbytes
+        shadow[changed] = old
+    frames = 0
+    restore(changed)
+    spyc_state.unpack_machine(checkpoints[-1][0])
+    spyc_video.invalidate()
+    return True
+
+
+reset()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Event scheduler (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Events are callbacks due at a given i8080.ticks value, kept in a heap.
+# run() lets the CPU go uninterrupted up to the nearest event, so devices
+# get their timing from here and never from the CPU loop itself. Frame end
+# event calls rebase() to bring ticks and all event times back by one frame.
+
+import heapq
+import itertools
+
+import i8080 as cpu
+
+queue = []  # Heap of (ticks, number, callback, period)
+numbers = itertools.count()  # Keep order of events due at the same time
+stopped = False
+base = 0  # Ticks taken away by rebase(), base + i8080.ticks is time since start
+
+
+def add(ticks, callback, period=0):
+    # Call callback when i8080.ticks reaches ticks, then every period ticks
+    heapq.heappush(queue, (ticks, next(numbers), callback, period))
+
+
+def after(delay, callback, period=0):
+    # Call callback in delay ticks from now, then every period ticks
+    add(cpu.ticks + delay, callback, period)
+
+
+def cancel(callback):
+    # Remove all events of callback
+    queue[:] = [event for event in queue if event[2] != callback]
+    heapq.heapify(queue)
+
+
+def rebase(delta):
+    # Move ticks counter and event times delta ticks back
+    global base
+    base += delta
+    cpu.ticks -= delta
+    queue[:] = [(ticks - delta, number, callback, period) for ticks, number, callback, period in queue]
+
+
+def stop():
+    # Make run() return once due events are called
+    global stopped
+    stopped = True
+
+
+def run(engine):
+    # Execute CPU with engine(budget) and call due events until one of them
+    # calls stop(). Periodic events are due every period ticks after their
+    # previous due time, so overrun of the last instruction is kept.
+    global stopped
+    stopped = False
+    while not stopped:
+        if not queue:
+            raise RuntimeError('no events queued, run() would never return')
+        due = queue[0][0]
+        if cpu.ticks < due:
+            engine(due - cpu.ticks)
+        while queue and queue[0][0] <= cpu.ticks:
+            ticks, number, callback, period = heapq.heappop(queue)
+            if period:
+                heapq.heappush(queue, (ticks + period, number, callback, period))
+            callback()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Screen rendering (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Video RAM bytes are expanded to pixels through 256 x 8 lookup table right
+# into the frame buffer, which is shared with 8 bit pygame surface. All
+# arrays are allocated once by init(), rendering a frame allocates nothing.
+
+import time
+
+import numpy as np
+import pygame
+
+import i8080 as cpu
+import spyc_video
+
+PALETTES = {'white': [(0, 0, 0), (255, 255, 255)],
+            'green': [(0, 24, 0), (64, 255, 64)],
+            'amber': [(24, 12, 0), (255, 176, 0)],
+            'paper': [(255, 255, 255), (0, 0, 0)]}
+
+lut = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)  # Byte -> 8 pixels
+column = np.empty((256, 8), np.uint8)  # Pixels of one column
+vram = np.frombuffer(cpu.memory, np.uint8)[0x9000:0xc000].reshape(spyc_video.COLUMNS, 256)
+
+scale = 1
+frame = None  # Frame buffer, 256 * scale rows of 384 * scale pixels
+surface = None  # Surface sharing frame buffer memory
+views = []  # Column areas of frame buffer as (row, scale, pixel, scale) arrays
+render_time = 0.0  # Seconds spent by the last render() call
+
+
+def init(new_scale=1, palette='white'):
+    # Allocate frame buffer for integer scale, return screen size
+    global scale, frame, surface, views
+    scale = new_scale
+    width = 8 * scale
+    frame = np.zeros((256 * scale, 384 * scale), np.uint8)
+    surface = pygame.image.frombuffer(frame, (384 * scale, 256 * scale), 'P')
+    set_palette(palette)
+    views = [frame[:, col * width:(col + 1) * width].reshape(256, scale, 8, scale)
+             for col in range(spyc_video.COLUMNS)]
+    spyc_video.invalidate()
+    return surface.get_size()
+
+
+def set_palette(name):
+    # Background and foreground colours from PALETTES
+    surface.set_palette(PALETTES[name])
+    spyc_video.invalidate()
+
+
+def render(screen):
+    # Draw video RAM columns changed since the last frame, False if none
+    global render_time
+    start = time.perf_counter()
+    changed = spyc_video.changed_columns()
+    width = 8 * scale
+    for col in changed:
+        np.take(lut, vram[col], axis=0, out=column)
+        views[col][...] = column[:, None, :, None]
+        screen.blit(surface, (col * width, 0), (col * width, 0, width, 256 * scale))
+    render_time = time.perf_counter() - start
+    return bool(changed)
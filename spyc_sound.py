@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Speaker sound (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Speaker is bit 5 of PPI port C. Writes only record ticks of level changes,
+# end_frame() turns them into one frame of 16 bit PCM with a single NumPy
+# searchsorted() and queues it to a mixer channel. Waiting for the queue to
+# empty paces emulation by the sound card instead of clock.tick().
+
+import time
+
+import numpy as np
+import pygame
+
+import i8080 as cpu
+import spyc_keyboard
+
+RATE = 44100
+FPS = 50
+SAMPLES = RATE // FPS  # Per frame
+AMPLITUDE = 6000
+SPEAKER = 0x20  # Port C bit
+
+enabled = False
+level = 0  # Speaker level now
+start_level = 0  # Speaker level at frame start
+edges = []  # Ticks of level changes since frame start
+channel = None
+
+
+def init():
+    # Open mixer, False if there is no sound device
+    global enabled, channel
+    try:
+        pygame.mixer.init(RATE, -16, 1, 512)
+    except pygame.error:
+        return False
+    channel = pygame.mixer.Channel(0)
+    spyc_keyboard.port_c_written = port_c
+    enabled = True
+    return True
+
+
+def port_c(byte):
+    # Port C written, record speaker level change
+    global level
+    if (byte & SPEAKER) != level:
+        level = byte & SPEAKER
+        edges.append(cpu.ticks)
+
+
+def frame_pcm(frame_ticks):
+    # Samples of the frame from level changes, clears them
+    global start_level
+    positions = np.arange(SAMPLES) * (frame_ticks / SAMPLES)
+    changes = np.searchsorted(np.array(edges, np.int64), positions, side='right')
+    pcm = np.where((changes & 1) ^ bool(start_level), AMPLITUDE, -AMPLITUDE).astype(np.int16)
+    start_level = level
+    del edges[:]
+    return pcm
+
+
+def skip_frame():
+    # Drop frame sound, e.g. in turbo mode
+    global start_level
+    start_level = level
+    del edges[:]
+
+
+def end_frame(frame_ticks, pace=True):
+    # Queue frame sound, with pace wait until the previous frame starts
+    # playing. Call before ticks are moved to the next frame.
+    if not enabled:
+        return skip_frame()
+    sound = pygame.mixer.Sound(buffer=frame_pcm(frame_ticks).tobytes())
+    if pace:
+        while channel.get_queue() is not None:
+            time.sleep(0.001)
+    if not channel.get_busy():
+        channel.play(sound)
+    elif channel.get_queue() is None:
+        channel.queue(sound)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Machine state saving and loading (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# State file is a header followed by 64 KB of memory and the rest of the
+# machine, the whole body zlib compressed or as is. Uncompressed memory is
+# read straight into i8080.memory with readinto().
+#
+#   header  magic 'SPYC', format version, flags (bit 0 - compressed)
+#   body    memory, registers BC DE HL AF, PC, SP, ticks, PPI mode,
+#           port latches, key matrix (7 rows of two bytes and rows byte)
+
+import hashlib
+import os
+import struct
+import zlib
+
+import i8080 as cpu
+import i8080_blocks
+import spyc_keyboard
+import spyc_library
+import spyc_video
+
+MAGIC = b'SPYC'
+VERSION = 1
+COMPRESSED = 1
+HEADER = struct.Struct('<4sHH')  # Magic, version, flags
+STATE = struct.Struct('<8sHHiB3s15s')  # Registers, PC, SP, ticks, mode, latches, matrix
+BOOT_KEYS = [282, 13, 117, 13]  # F1, ENTER, U, ENTER: start loaded game from monitor
+WARM_DIR = 'states'  # Automatic snapshots
+
+
+def pack_machine():
+    # Machine state except memory as bytes
+    cpu.flags2f()
+    kb = spyc_keyboard
+    matrix = bytes([byte for row in kb.kb_matrix[:7] for byte in row] + [kb.kb_matrix[7]])
+    return STATE.pack(bytes(cpu.regfile), cpu.pc, cpu.sp, cpu.ticks, kb.vv55a_mode, bytes(kb.kb_mem), matrix)
+
+
+def unpack_machine(state):
+    # Restore machine state except memory from pack_machine() bytes
+    regs, cpu.pc, cpu.sp, cpu.ticks, mode, latches, matrix = STATE.unpack(state)
+    cpu.regfile[:] = regs
+    cpu.f2flags()
+    kb = spyc_keyboard
+    kb.vv55a_mode = mode
+    kb.kb_mem[:] = latches
+    for i in range(7):
+        kb.kb_matrix[i][:] = matrix[2 * i:2 * i + 2]
+    kb.kb_matrix[7] = matrix[14]
+    kb.update_ports()
+
+
+def save(filename, compress=True):
+    # Write machine state to file
+    state = pack_machine()
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, COMPRESSED if compress else 0))
+        if compress:
+            f.write(zlib.compress(bytes(cpu.memory) + state))
+        else:
+            f.write(cpu.memory)
+            f.write(state)
+
+
+def load(filename):
+    # Read machine state from file, ValueError if it is not a state file
+    # of this version
+    with open(filename, 'rb') as f:
+        magic, version, flags = HEADER.unpack(f.read(HEADER.size).ljust(HEADER.size, b'\0'))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d state file' % (filename, VERSION))
+        if flags & COMPRESSED:
+            try:
+                body = zlib.decompress(f.read())
+            except zlib.error:
+                raise ValueError('%s is damaged' % filename)
+            if len(body) != len(cpu.memory) + STATE.size:
+                raise ValueError('%s is damaged' % filename)
+            cpu.memory[:] = body[:len(cpu.memory)]
+            state = body[len(cpu.memory):]
+        else:
+            if f.readinto(cpu.memory) != len(cpu.memory):
+                raise ValueError('%s is damaged' % filename)
+            state = f.read(STATE.size)
+            if len(state) != STATE.size:
+                raise ValueError('%s is damaged' % filename)
+    unpack_machine(state)
+    # Memory was replaced bypassing write_mem()
+    i8080_blocks.flush()
+    cpu.code_dirty = False
+    spyc_video.invalidate()
+
+
+def machine_hash(rom, game):
+    # Hash of ROM file and game from library
+    digest = hashlib.sha1()
+    with open(rom, 'rb') as f:
+        digest.update(f.read())
+    digest.update(spyc_library.find(game)['sha1'].encode())
+    return digest.hexdigest()[:16]
+
+
+def warm_path(rom, game):
+    # Automatic snapshot file of ROM and game
+    return os.path.join(WARM_DIR, 'warm_%s.sps' % machine_hash(rom, game))
+
+
+def load_warm(rom, game):
+    # Restore automatic snapshot of ROM and game booted and game started,
+    # False if there is none or it can't be loaded
+    try:
+        path = warm_path(rom, game)
+    except KeyError:
+        return False  # Game is not in library
+    if not os.path.exists(path):
+        return False
+    try:
+        load(path)
+    except ValueError:
+        return False
+    return True
+
+
+def save_warm(rom, game, run, frame_ticks):
+    # Make automatic snapshot: type BOOT_KEYS into freshly loaded machine,
+    # running it with run(budget) frame by frame, and save it
+    for frame in range(20 * len(BOOT_KEYS) + 20):
+        key = frame // 20
+        if key < len(BOOT_KEYS):
+            if frame % 20 == 0:
+                spyc_keyboard.keydown(BOOT_KEYS[key])
+            elif frame % 20 == 5:
+                spyc_keyboard.keyup(BOOT_KEYS[key])
+        run(frame_ticks - cpu.ticks)
+        cpu.ticks -= frame_ticks
+    os.makedirs(WARM_DIR, exist_ok=True)
+    save(warm_path(rom, game))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Tape (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+# Tape image is the byte stream the ROM reads: pilot of zero bytes, sync
+# byte E6h (19h when the recording is inverted) and data bytes after it,
+# every block has its own pilot and sync. RKS file is one such block without
+# them. ROM tape routines traps of spyc_hle take bytes from here.
+#
+# Tape signal is a list of ticks when the level changes. Every bit is two
+# halves with an edge between them, the level after it is the bit, ROM
+# reader skips edges at bit boundaries by a delay. play() puts the signal
+# on PPI port B bit 0, record() takes it from port C bit 7, all times are
+# counted in spyc_sched.base + i8080.ticks. WAV files are converted to and
+# from signals with NumPy, no Python loop over samples.
+#
+#   python spyc_tape.py tape.wav game.rks
+#
+# decodes recording and saves its last block as RKS file.
+
+import sys
+import wave
+
+import numpy as np
+
+import i8080 as cpu
+import i8080_loops
+import spyc_keyboard
+import spyc_sched
+
+SYNC = 0xe6
+PILOT = 256  # Zero bytes before sync when RKS file is put on tape
+CPU_HZ = 2000000
+HALF_BIT = 708  # Ticks between edges of a bit written by ROM at default speed
+TAPE_IN = 0x01  # Port B bit
+TAPE_OUT = 0x80  # Port C bit
+WAV_RATE = 44100
+AMPLITUDE = 20000
+DC_WINDOW = 0.005  # Seconds of moving average taken as DC offset of recording
+HYSTERESIS = 0.4  # Of loud signal level, noise below it makes no edges
+GAP = 4  # Half bits without edges ending a block
+
+tape = b''
+position = 0  # Next byte to read
+
+play_edges = []  # Signal put on port B
+play_next = 0  # Index of the first edge not passed yet
+play_level = 1  # Level before the first edge
+rec_edges = []  # Signal taken from port C
+rec_level = 0  # Level before the first recorded edge
+rec_now = 0  # Recorded level now
+chained = None  # Port C hook called after the recorder, e.g. spyc_sound
+recording = False
+
+
+def attach(data):
+    # Put tape image into the tape recorder and rewind it
+    global tape, position
+    tape = bytes(data)
+    position = 0
+
+
+def attach_rks(data):
+    # Put RKS file on tape as one block, as ROM loader at boot expects it
+    attach(bytes(PILOT) + bytes((SYNC,)) + bytes(data))
+
+
+def attach_file(filename):
+    # RKS file or raw tape image
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if filename.lower().endswith('.rks'):
+        attach_rks(data)
+    else:
+        attach(data)
+
+
+def sync():
+    # Skip to the byte after the next sync byte, return 0 for normal and
+    # FFh for inverted recording, None if there is no sync up to the end
+    global position
+    found = [i for i in (tape.find(SYNC, position), tape.find(SYNC ^ 0xff, position)) if i >= 0]
+    if not found:
+        return None
+    position = min(found) + 1
+    return 0 if tape[position - 1] == SYNC else 0xff
+
+
+def read(count):
+    # Next count bytes as they are on tape, None if tape ends before
+    global position
+    if position + count > len(tape):
+        return None
+    position += count
+    return tape[position - count:position]
+
+
+def now():
+    # Ticks since emulator start
+    return spyc_sched.base + cpu.ticks
+
+
+def read_ports(addr):
+    # Keyboard ports with tape level in port B bit 0
+    global play_next
+    if addr & 3 != 1 or spyc_keyboard.vv55a_mode != 0x82:
+        return spyc_keyboard.kb_ports[addr & 3]
+    time = spyc_sched.base + cpu.ticks
+    while play_next < len(play_edges) and play_edges[play_next] <= time:
+        play_next += 1
+    return spyc_keyboard.kb_ports[1] & ~TAPE_IN | (play_level ^ play_next & 1)
+
+
+def play(edges, level, delay=0):
+    # Start signal on port B in delay ticks, edges are ticks since its start
+    global play_edges, play_next, play_level
+    play_edges = (np.asarray(edges, np.int64) + now() + delay).tolist()
+    play_next = 0
+    play_level = level
+    cpu.map_pages(0xf8, 0xff, read_ports, spyc_keyboard.write_kb_ports)
+    i8080_loops.next_input = next_edge
+
+
+def stop():
+    # Stop signal, port B bit 0 is high again
+    cpu.map_pages(0xf8, 0xff, spyc_keyboard.read_kb_ports, spyc_keyboard.write_kb_ports)
+    i8080_loops.next_input = None
+
+
+def next_edge():
+    # Ticks of the next edge of played signal, None after the last one.
+    # Polling loops are not skipped past it.
+    if play_next < len(play_edges):
+        return play_edges[play_next] - spyc_sched.base
+    return None
+
+
+def signal(image, half=HALF_BIT):
+    # Signal of tape image bytes as ROM writes them, return edges and level
+    # before the first one
+    bits = np.unpackbits(np.frombuffer(bytes(image), np.uint8))
+    levels = np.column_stack((bits ^ 1, bits)).ravel()
+    edges = (np.flatnonzero(levels[1:] != levels[:-1]) + 1) * half
+    return edges, int(levels[0])
+
+
+def port_c(byte):
+    # Port C written, record tape output level change
+    global rec_now
+    if recording and (byte & TAPE_OUT) != rec_now:
+        rec_now = byte & TAPE_OUT
+        rec_edges.append(now())
+    if chained:
+        chained(byte)
+
+
+def record():
+    # Start recording port C bit 7
+    global rec_edges, rec_level, rec_now, chained, recording
+    if spyc_keyboard.port_c_written is not port_c:
+        chained = spyc_keyboard.port_c_written
+        spyc_keyboard.port_c_written = port_c
+    rec_edges = []
+    rec_now = (0xff - spyc_keyboard.kb_mem[2]) & TAPE_OUT
+    rec_level = int(bool(rec_now))
+    recording = True
+
+
+def stop_recording():
+    # Recorded signal with edges counted from the first one, and level
+    # before it
+    global recording
+    recording = False
+    edges = np.array(rec_edges, np.int64)
+    return edges - (edges[0] if len(edges) else 0), rec_level
+
+
+def read_wav(filename):
+    # Signal of WAV recording: zero crossings after DC offset removal,
+    # interpolated between samples
+    with wave.open(filename) as f:
+        rate, width, channels = f.getframerate(), f.getsampwidth(), f.getnchannels()
+        frames = f.readframes(f.getnframes())
+    if width == 1:
+        samples = np.frombuffer(frames, np.uint8).astype(np.float32) - 128
+    elif width in (2, 4):
+        samples = np.frombuffer(frames, '<i%d' % width).astype(np.float32)
+    else:
+        raise ValueError('%d bit WAV files are not supported' % (width * 8))
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if len(samples) < 2:
+        raise ValueError('%s is too short' % filename)
+    window = max(1, min(int(rate * DC_WINDOW), len(samples)))
+    total = np.concatenate(([0], np.cumsum(samples, dtype=np.float64)))
+    average = (total[window:] - total[:-window]) / window
+    average = np.concatenate((np.full(window // 2, average[0]), average,
+                              np.full(len(samples) - len(average) - window // 2, average[-1])))
+    level = samples - average
+    # Level changes when signal goes over threshold of the other side, edge
+    # is the zero crossing before it
+    threshold = HYSTERESIS * np.percentile(np.abs(level), 90) if len(level) else 0
+    state = np.where(level > threshold, 1, np.where(level < -threshold, 0, -1))
+    known = np.flatnonzero(state >= 0)
+    if not threshold or not len(known):
+        return np.zeros(0, np.int64), 1
+    state = state[known]
+    switch = known[np.flatnonzero(state[1:] != state[:-1]) + 1]
+    high = level > 0
+    cross = np.flatnonzero(high[1:] != high[:-1])
+    cross = cross[np.searchsorted(cross, switch - 1, side='right') - 1]
+    before, after = level[cross], level[cross + 1]
+    edges = (cross + before / (before - after)) * (CPU_HZ / rate)
+    return edges.astype(np.int64), int(state[0])
+
+
+def write_wav(filename, edges, level, rate=WAV_RATE):
+    # Save signal as 16 bit mono WAV file with 0.1 s of silence after it
+    edges = np.asarray(edges, np.int64)
+    end = (edges[-1] if len(edges) else 0) / CPU_HZ + 0.1
+    positions = np.arange(int(end * rate)) * (CPU_HZ / rate)
+    changes = np.searchsorted(edges, positions, side='right')
+    pcm = np.where((changes & 1) ^ level, AMPLITUDE, -AMPLITUDE).astype('<i2')
+    with wave.open(filename, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(pcm.tobytes())
+
+
+def bits_of(edges, level):
+    # Bits read the way ROM does it: level after the edge in the middle of
+    # a bit. Edge after a whole bit without edges is such one, so is every
+    # second edge after it, the first edge of the signal starts the count.
+    index = np.arange(len(edges))
+    half = np.median(np.diff(edges))
+    after_long = np.concatenate(([True], np.diff(edges) > 1.5 * half))
+    anchor = np.maximum.accumulate(np.where(after_long, index, 0))
+    middle = index[(index - anchor) % 2 == 0]
+    return (level ^ (middle + 1) & 1).astype(np.uint8)
+
+
+def decode(edges, level):
+    # Tape image of signal: blocks between gaps, each from its sync byte on
+    edges = np.asarray(edges, np.int64)
+    if len(edges) < 16:
+        return b''
+    half = np.median(np.diff(edges))
+    image = b''
+    for block in np.split(np.arange(len(edges)), np.flatnonzero(np.diff(edges) > GAP * half) + 1):
+        if len(block) < 16:
+            continue
+        bits = bits_of(edges[block], level ^ block[0] & 1)
+        values = np.convolve(bits, 1 << np.arange(8), 'valid')  # Byte of 8 bits from every position
+        found = np.flatnonzero((values == SYNC) | (values == SYNC ^ 0xff))
+        if not len(found):
+            continue
+        data = np.packbits(bits[found[0] + 8:]).tobytes()[:(len(bits) - found[0] - 8) // 8]
+        if values[found[0]] != SYNC:
+            data = bytes(b ^ 0xff for b in data)
+        image += bytes(PILOT) + bytes((SYNC,)) + data
+    return image
+
+
+def last_block(image):
+    # RKS file of the last block on tape image, ValueError if it is broken
+    import spyc_library
+    start = image.rfind(bytes(PILOT) + bytes((SYNC,)))
+    data = image[start + PILOT + 1:] if start >= 0 else b''
+    first, last = spyc_library.check(data)
+    return data[:last - first + 7]
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit('usage: python spyc_tape.py tape.wav game.rks')
+    image = decode(*read_wav(sys.argv[1]))
+    with open(sys.argv[2], 'wb') as f:
+        f.write(last_block(image))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Video memory (part of sPycialist - Specialist PC Emulator)
+# (C) Stanislav Yudin (CityAceE)
+# http://zx-pk.ru
+
+import i8080 as cpu
+
+VIDEO_PAGE = 0x90  # Video RAM 0x9000-0xBFFF, every page is 8 pixels wide column
+COLUMNS = 48
+
+dirty = bytearray(b'\x01' * COLUMNS)  # Columns changed since the last frame
+
+
+def video_write(addr, byte):
+    # First write to a column since the last frame marks it changed and
+    # unmaps its page, so the next writes go straight to memory
+    page = addr >> 8
+    cpu.memory[addr] = byte
+    dirty[page - VIDEO_PAGE] = 1
+    cpu.map_pages(page, page)
+
+
+def changed_columns():
+    # List of columns changed since the previous call, watch them again
+    columns = [col for col in range(COLUMNS) if dirty[col]]
+    for col in columns:
+        dirty[col] = 0
+        cpu.map_pages(VIDEO_PAGE + col, VIDEO_PAGE + col, None, video_write)
+    return columns
+
+
+def invalidate():
+    # Whole screen has to be redrawn, e.g. after memory loading bypassing write_mem()
+    dirty[:] = b'\x01' * COLUMNS
+
+
+cpu.map_pages(VIDEO_PAGE, VIDEO_PAGE + COLUMNS - 1, None, video_write)
@@ -7,35 +7,141 @@
 #
 # ver.0.5, 20th January 2019
 
+import os
+import sys
+import time
+
 import pygame
-import pygame.surfarray
-import numpy as np
 
 import i8080 as cpu
+import i8080_alu
+import i8080_blocks
+import i8080_loops
+import i8080_prof
+import i8080_trace
+import spyc_library
 import spyc_loader
+import spyc_hle
 import spyc_keyboard
-
-GAME = 'zoo.rks'
+import spyc_mp
+import spyc_rewind
+import spyc_sched
+import spyc_screen
+import spyc_sound
+import spyc_state
+import spyc_tape
+
+GAME = sys.argv[sys.argv.index('--game') + 1] if '--game' in sys.argv else 'zoo'  # Name in game library
+LIBRARY = ['.']  # Directories and zip archives with RKS games, see spyc_library
 ROM = 'system.rom'
 SHOW_FPS = True
 CPU_CLOCK = 2  # In MHz. Default Intel 8080 frequency is 2 MHz
+TRANSLATE = True  # Run translated basic blocks instead of single instructions
+LAZY_FLAGS = False  # Compute flags only when an instruction reads them, not run through CPU exerciser yet
+ALU_TABLES = False  # Precomputed ALU results in lazy flags mode, see i8080_alu
+HLE = True  # Native versions of hot ROM routines in translated blocks mode, see spyc_hle
+LOOPS = True  # Skip delay and polling loops, fill and copy in bulk, in translated blocks mode, see i8080_loops
+SCALE = 2  # Integer screen scale
+PALETTE = 'white'  # One of spyc_screen.PALETTES
+PROFILE = False  # Count opcodes and addresses, report goes to PROFILE_FILE on exit
+PROFILE_FILE = 'profile.txt'
+PROFILE_CALLS = False  # Also build subroutine call graph, flame graph stacks go to profile.folded
+SYMBOLS = None  # Routine names file for call graph, see i8080_prof.load_symbols()
+TRACE = False  # Record last TRACE_RECORDS instructions to TRACE_FILE, decode with i8080_trace.py
+TRACE_FILE = 'trace.bin'
+TRACE_RECORDS = 1 << 20
+WARM_BOOT = False  # Start from automatic snapshot of the game already started, see spyc_state
+TAPE = '--tape' in sys.argv  # Game goes on tape, ROM loads and starts it at boot (no warm boot), see spyc_tape
+WAV = sys.argv[sys.argv.index('--wav') + 1] if '--wav' in sys.argv else None  # Recording played on tape input
+# Tape output goes to TAPE_OUT.wav on exit and its last valid block to TAPE_OUT.rks
+TAPE_OUT = sys.argv[sys.argv.index('--tape-out') + 1] if '--tape-out' in sys.argv else None
+STATE_FILE = 'spycialist.sps'
+SAVE_KEY = pygame.K_INSERT  # Save state to STATE_FILE
+LOAD_KEY = pygame.K_END  # Load state from STATE_FILE
+REWIND = True  # Keep history for going back in time, see spyc_rewind
+REWIND_KEY = pygame.K_PAGEUP  # Hold to go back in time
+TURBO = '--turbo' in sys.argv  # Run as fast as host allows, also toggled by TURBO_KEY
+TURBO_KEY = pygame.K_TAB
+TURBO_RENDER = 0.04  # Seconds between screen updates in turbo mode
+SEPARATE_CPU = '--mp' in sys.argv  # CPU in its own process, see spyc_mp
+SOUND = True  # Speaker sound, emulation is paced by sound card when it is on
+
+spyc_library.open_index()
+if '--scan' in sys.argv or '--list' in sys.argv:
+    for problem in spyc_library.scan(LIBRARY):
+        print('Skipped', problem)
+if '--list' in sys.argv:
+    for name, game in sorted(spyc_library.games.items()):
+        print('{:16} {:04X}-{:04X}  {}'.format(name, game['start'], game['end'],
+                                              game['path'] + (':' + game['member'] if game['member'] else '')))
+    sys.exit()
+try:
+    spyc_library.find(GAME, LIBRARY)
+except KeyError:
+    print('No game %s in library, see --list' % GAME)
+    sys.exit(1)
 
-cpu.pc = spyc_loader.game(GAME)
-spyc_loader.rom(ROM, 0xc000)
-cpu.pc = 0xc000
-cpu.sp = 0x7FFF
 debug = False
 running = True
+rewinding = False
+turbo = TURBO
+last_render = 0.0
 int_ticks = int(CPU_CLOCK * 1000000 / 50)
-screen = pygame.display.set_mode((384, 256), 0, 8)
+screen = pygame.display.set_mode(spyc_screen.init(SCALE, PALETTE))
 caption = "sPycialist"
 pygame.display.set_caption(caption)
+if SEPARATE_CPU:
+    spyc_mp.display(screen, ROM, GAME, WARM_BOOT, HLE, LOOPS, LAZY_FLAGS)
+    pygame.quit()
+    sys.exit()
+run = i8080_blocks.run if TRANSLATE else cpu.run
+i8080_blocks.set_lazy_flags(LAZY_FLAGS)
+i8080_loops.set_loop_skipping(LOOPS)
+if ALU_TABLES:
+    i8080_alu.set_alu_tables(True)
+if PROFILE:
+    run = cpu.run  # Translated blocks bypass profiled dispatch table
+    i8080_prof.set_profiling(True, PROFILE_CALLS)
+    if SYMBOLS:
+        i8080_prof.load_symbols(SYMBOLS)
+if TRACE:
+    run = cpu.run  # Translated blocks bypass traced dispatch table
+    i8080_trace.start(TRACE_RECORDS, TRACE_FILE)
 
-
-def blitsurface():
-    mem = np.reshape(cpu.memory[0x9000:0xc000], (256, 48), 'F')
-    bits = np.unpackbits(mem) * 255
-    pygame.surfarray.blit_array(screen, np.reshape(bits, (256, 384)).T)
+spyc_loader.rom(ROM, 0xc000)
+if HLE:
+    spyc_hle.install()
+if TAPE:
+    spyc_tape.attach_rks(spyc_library.read(GAME))
+    if run is not i8080_blocks.run or 0xc377 not in i8080_blocks.traps:
+        spyc_tape.play(*spyc_tape.signal(spyc_tape.tape))  # No tape traps, ROM reads the signal
+    cpu.pc = 0xc000
+    cpu.sp = 0x7FFF
+elif not (WARM_BOOT and spyc_state.load_warm(ROM, GAME)):
+    cpu.pc = spyc_library.load(GAME)
+    cpu.pc = 0xc000
+    cpu.sp = 0x7FFF
+    if WARM_BOOT:
+        spyc_state.save_warm(ROM, GAME, run, int_ticks)
+if WAV:
+    spyc_tape.play(*spyc_tape.read_wav(WAV))
+spyc_rewind.reset()
+
+
+def end_frame():
+    # Frame end event: return to main loop for screen and input
+    if sound and not turbo:
+        spyc_sound.end_frame(int_ticks)
+    else:
+        spyc_sound.skip_frame()
+    spyc_sched.rebase(int_ticks)  # Keep overrun of the last instruction for the next frame
+    spyc_sched.stop()
+
+
+spyc_sched.add(int_ticks, end_frame, int_ticks)
+sound = SOUND and spyc_sound.init()
+if TAPE_OUT:
+    spyc_tape.record()  # After sound, which hooks port C too
 
 
 try:
@@ -44,38 +150,83 @@ try:
 
         # START OF MAIN LOOP
 
-        # # FOR DEBUGGING
-        # if (cpu.pc == 0xc1ff):  # and (cpu.reg_h == 0x3d) and (cpu.reg_l == 0xf8):  # Trap conditions
-        #     debug = True
-        #     # print('PC:', hex(cpu.pc))
-        #     pass
-        # if debug:
-        #     # blitsurface()
-        #     # pygame.display.flip()
-        #     cpu.display_regs()  # Set breakpoint here
-
-        cpu.core()
-        if cpu.ticks > int_ticks:
-            cpu.ticks = 0
-            blitsurface()
-            pygame.display.flip()
-            clock.tick(52)
-
-            # END OF MAIN LOOP
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                if event.type == pygame.KEYDOWN:
-                    spyc_keyboard.keydown(event.key)
-                if event.type == pygame.KEYUP:
-                    spyc_keyboard.keyup(event.key)
-
-            if SHOW_FPS:
-                fps = clock.get_fps()
-                with_fps = "{} - {:.2f} FPS".format(caption, fps)
-                pygame.display.set_caption(with_fps)
+        # # FOR DEBUGGING (replaces spyc_sched.run() call below with single instruction steps)
+        # while cpu.ticks < int_ticks:
+        #     if (cpu.pc == 0xc1ff):  # and (cpu.reg_h == 0x3d) and (cpu.reg_l == 0xf8):  # Trap conditions
+        #         debug = True
+        #         # print('PC:', hex(cpu.pc))
+        #         pass
+        #     if debug:
+        #         # spyc_screen.render(screen)
+        #         # pygame.display.flip()
+        #         cpu.display_regs()  # Set breakpoint here
+        #     cpu.core()
+
+        if rewinding:
+            spyc_rewind.step_back()
+        else:
+            spyc_sched.run(run)
+            if REWIND:
+                spyc_rewind.frame()
+        if not turbo:
+            if spyc_screen.render(screen):
+                pygame.display.flip()
+            if sound and not rewinding:
+                clock.tick()  # Already paced by sound card in end_frame()
+            else:
+                clock.tick(52)
+        else:
+            # Skip frames, render only when TURBO_RENDER seconds passed
+            if time.perf_counter() - last_render >= TURBO_RENDER:
+                last_render = time.perf_counter()
+                if spyc_screen.render(screen):
+                    pygame.display.flip()
+            clock.tick()
+
+        # END OF MAIN LOOP
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            if event.type == pygame.KEYDOWN:
+                if event.key == SAVE_KEY:
+                    spyc_state.save(STATE_FILE)
+                elif event.key == LOAD_KEY and os.path.exists(STATE_FILE):
+                    spyc_state.load(STATE_FILE)
+                    spyc_rewind.reset()
+                elif event.key == REWIND_KEY and REWIND:
+                    rewinding = True
+                elif event.key == TURBO_KEY:
+                    turbo = not turbo
+                spyc_keyboard.keydown(event.key)
+            if event.type == pygame.KEYUP:
+                if event.key == REWIND_KEY:
+                    rewinding = False
+                spyc_keyboard.keyup(event.key)
+
+        if SHOW_FPS:
+            fps = clock.get_fps()
+            with_fps = "{} - {:.2f} FPS - render {:.2f} ms".format(caption, fps, spyc_screen.render_time * 1000)
+            if turbo:
+                with_fps += " - TURBO x{:.1f}".format(fps / 50)
+            pygame.display.set_caption(with_fps)
 
     pygame.quit()
+    if PROFILE:
+        i8080_prof.dump(PROFILE_FILE)
+    if TAPE_OUT:
+        edges, level = spyc_tape.stop_recording()
+        if len(edges) > 16:
+            spyc_tape.write_wav(TAPE_OUT + '.wav', edges, level)
+            try:
+                data = spyc_tape.last_block(spyc_tape.decode(edges, level))
+            except ValueError:
+                pass
+            else:
+                with open(TAPE_OUT + '.rks', 'wb') as f:
+                    f.write(data)
 except SystemExit:
     pygame.quit()
+finally:
+    if TRACE:
+        i8080_trace.stop()  # Crashed session keeps its trace too